@@ -38,6 +38,17 @@
 #   - [ 6.1 - Bringing it all together](#6.1)
 #     - [ Exercise 3](#ex03)
 # - [ 7 - Test with any system of equations!](#7)
+# - [ 8 - Going further (Section NOT graded)](#8)
+#   - [ 8.1 - Solving large systems: blocked LU factorization](#8.1)
+#   - [ 8.2 - Factorize once, solve many times](#8.2)
+#   - [ 8.3 - Unique, infinite or no solution?](#8.3)
+#   - [ 8.4 - Solving many small systems at once](#8.4)
+#   - [ 8.5 - Large sparse systems](#8.5)
+#   - [ 8.6 - Reading large systems from files](#8.6)
+#   - [ 8.7 - Working in place](#8.7)
+#   - [ 8.8 - Mixed precision and iterative refinement](#8.8)
+#   - [ 8.9 - Back substitution with matrix products](#8.9)
+#   - [ 8.10 - Testing the functions of this section](#8.10)
 # 
 
 # <a name="1"></a>
@@ -159,7 +170,7 @@ import w2_unittest
 # In[70]:
 
 
-def swap_rows(M, row_index_1, row_index_2):
+def swap_rows(M, row_index_1, row_index_2, overwrite = False):
     """
     Swap rows in the given matrix.
 
@@ -167,10 +178,15 @@ def swap_rows(M, row_index_1, row_index_2):
     - matrix (numpy.array): The input matrix to perform row swaps on.
     - row_index_1 (int): Index of the first row to be swapped.
     - row_index_2 (int): Index of the second row to be swapped.
+    - overwrite (bool): Pass this True to swap the rows of M in place, without copying it.
+
+    Returns:
+    numpy.array: The matrix with the rows swapped (M itself if overwrite is True).
     """
 
     # Copy matrix M so the changes do not affect the original matrix. 
-    M = M.copy()
+    if overwrite == False:
+        M = M.copy()
     # Swap indexes
     M[[row_index_1, row_index_2]] = M[[row_index_2, row_index_1]]
     return M
@@ -230,7 +246,7 @@ print(M_swapped)
 # In[73]:
 
 
-def get_index_first_non_zero_value_from_column(M, column, starting_row):
+def get_index_first_non_zero_value_from_column(M, column, starting_row, atol = 1e-5, largest = False):
     """
     Retrieve the index of the first non-zero value in a specified column of the given matrix.
 
@@ -238,22 +254,30 @@ def get_index_first_non_zero_value_from_column(M, column, starting_row):
     - matrix (numpy.array): The input matrix to search for non-zero values.
     - column (int): The index of the column to search.
     - starting_row (int): The starting row index for the search.
+    - atol (float): Values with absolute value smaller than or equal to atol are considered zero.
+    - largest (bool): Pass this True to get the index of the value with the largest absolute value instead of the first
+                      non-zero value (partial pivoting).
 
     Returns:
-    int: The index of the first non-zero value in the specified column, starting from the given row.
+    int: The index of the first non-zero value (or of the largest one) in the specified column, starting from the given row.
                 Returns -1 if no non-zero value is found.
     """
     # Get the column array starting from the specified row
     column_array = M[starting_row:,column]
-    for i, val in enumerate(column_array):
-        # Iterate over every value in the column array. 
-        # To check for non-zero values, you must always use np.isclose instead of doing "val == 0".
-        if not np.isclose(val, 0, atol = 1e-5):
-            # If one non zero value is found, then adjust the index to match the correct index in the matrix and return it.
-            index = i + starting_row
-            return index
+    # To check for non-zero values, you must always use np.isclose instead of doing "val == 0".
+    # Instead of iterating over every value in the column array, np.isclose checks all of them at once,
+    # and np.flatnonzero returns the indices of the non-zero values.
+    non_zero_indices = np.flatnonzero(~np.isclose(column_array, 0, atol = atol))
     # If no non-zero value is found below it, return -1.
-    return -1
+    if len(non_zero_indices) == 0:
+        return -1
+    if largest == True:
+        # Partial pivoting: the value with the largest absolute value, which reduces the rounding errors
+        index = np.argmax(np.abs(column_array))
+    else:
+        index = non_zero_indices[0]
+    # Adjust the index to match the correct index in the matrix
+    return int(index) + starting_row
 
 
 # Let's practice with this function. Consider the following matrix.
@@ -311,22 +335,19 @@ def get_index_first_non_zero_value_from_row(M, row, augmented = False):
                 Returns -1 if no non-zero value is found.
     """
 
-    # Create a copy to avoid modifying the original matrix
-    M = M.copy()
-
+    # Get the desired row. Slicing doesn't modify the original matrix, so there is no need to copy it
+    row_array = M[row]
 
     # If it is an augmented matrix, then ignore the constant values
     if augmented == True:
-        # Isolating the coefficient matrix (removing the constant terms)
-        M = M[:,:-1]
-        
-    # Get the desired row
-    row_array = M[row]
-    for i, val in enumerate(row_array):
-        # If finds a non zero value, returns the index. Otherwise returns -1.
-        if not np.isclose(val, 0, atol = 1e-5):
-            return i
-    return -1
+        # Isolating the coefficients (removing the constant term)
+        row_array = row_array[:-1]
+
+    # If finds a non zero value, returns the index. Otherwise returns -1.
+    non_zero_indices = np.flatnonzero(~np.isclose(row_array, 0, atol = 1e-5))
+    if len(non_zero_indices) == 0:
+        return -1
+    return int(non_zero_indices[0])
 
 
 # Let's practice with the same matrix as before:
@@ -642,7 +663,7 @@ print(augmented_matrix(A,B))
 
 # GRADED FUNCTION: row_echelon_form
 
-def row_echelon_form(A, B):
+def row_echelon_form(A, B, partial_pivoting = False):
     """
     Utilizes elementary row operations to transform a given set of matrices, 
     which represent the coefficients and constant terms of a linear system, into row echelon form.
@@ -650,32 +671,26 @@ def row_echelon_form(A, B):
     Parameters:
     - A (numpy.array): The input square matrix of coefficients.
     - B (numpy.array): The input column matrix of constant terms
+    - partial_pivoting (bool): Pass this True to always choose the pivot with the largest absolute value in its column,
+                               which reduces the rounding errors. By default, a row is swapped only if its pivot is zero.
 
     Returns:
     numpy.array: A new augmented matrix in row echelon form with pivots as 1.
     """
     
-    # Before any computation, check if matrix A (coefficient matrix) has non-zero determinant. 
-    # It will be used the numpy sub library np.linalg to compute it.
-
-    det_A = np.linalg.det(A)
-
-    # Returns "Singular system" if determinant is zero
-    if np.isclose(det_A, 0) == True:
-        return 'Singular system'
-
-    # Make copies of the input matrices to avoid modifying the originals
-    A = A.copy()
-    B = B.copy()
-
-
-    # Convert matrices to float to prevent integer division
-    A = A.astype('float64')
-    B = B.astype('float64')
+    # Convert matrices to float to prevent integer division. There is no need to copy them: the augmented matrix below
+    # is a new matrix, and every row operation modifies it in place, so the original matrices are never modified.
+    A = np.asarray(A, dtype = 'float64')
+    B = np.asarray(B, dtype = 'float64')
 
     # Number of rows in the coefficient matrix
     num_rows = len(A) 
 
+    # There is no need to compute the determinant to know if the system is singular: it is singular exactly when
+    # no pivot can be found for some row.
+    # Values smaller than or equal to atol, the default tolerance of np.isclose, are considered zero, with or without partial pivoting.
+    atol = 1e-8
+
     ### START CODE HERE ###
 
     # Transform matrices A and B into the augmented matrix M
@@ -691,12 +706,17 @@ def row_echelon_form(A, B):
         # If pivot_candidate is zero, it cannot be a pivot for this row. 
         # So the first step you need to take is to look at the rows below it to check if there is a non-zero element in the same column.
         # The usage of np.isclose is a good practice when comparing two floats.
-        if np.isclose(pivot_candidate, 0) == True: 
-            # Get the index of the first non-zero value below the pivot_candidate. 
-            first_non_zero_value_below_pivot_candidate = get_index_first_non_zero_value_from_column(M, row, row) 
+        # With partial pivoting, the rows below are always checked for a larger value.
+        if partial_pivoting == True or np.isclose(pivot_candidate, 0, atol = atol) == True: 
+            # Get the index of the first non-zero value below the pivot_candidate (or of the largest one). 
+            first_non_zero_value_below_pivot_candidate = get_index_first_non_zero_value_from_column(M, row, row, atol = atol, largest = partial_pivoting) 
+
+            # Returns "Singular system" if there is no pivot for this row
+            if first_non_zero_value_below_pivot_candidate == -1:
+                return 'Singular system'
 
             # Swap rows
-            M = swap_rows(M, row, first_non_zero_value_below_pivot_candidate) 
+            M = swap_rows(M, row, first_non_zero_value_below_pivot_candidate, overwrite = True) 
 
             # Get the pivot, which is in the main diagonal now 
             pivot = M[row,row] 
@@ -709,18 +729,19 @@ def row_echelon_form(A, B):
             
         # Divide the current row by the pivot, so the new pivot will be 1. You may use the formula current_row -> 1/pivot * current_row
         # Where current_row can be accessed using M[row].
-        M[row] = (1/pivot) * M[row]
+        M[row] *= 1/pivot
 
         # Perform row reduction for rows below the current row
-        for j in range(row + 1, num_rows): 
-            # Get the value in the row that is below the pivot value. 
-            # Remember that, since you are dealing only with non-singular matrices, the pivot is in the main diagonal.
-            # Therefore, the values in row j that are below the pivot, must have column index the same index as the column index for the pivot.
-            value_below_pivot = M[j,row]
-
-            # Perform row reduction using the formula:
-            # row_to_reduce -> row_to_reduce - value_below_pivot * pivot_row
-            M[j] = M[j] - value_below_pivot*M[row]
+        # Get the values in the rows that are below the pivot value. 
+        # Remember that, since you are dealing only with non-singular matrices, the pivot is in the main diagonal.
+        # Therefore, the values below the pivot must have column index the same index as the column index for the pivot.
+        values_below_pivot = M[row + 1:, row]
+
+        # Perform row reduction using the formula:
+        # row_to_reduce -> row_to_reduce - value_below_pivot * pivot_row
+        # for every row below the current one at once: np.outer(values_below_pivot, M[row]) has one row
+        # value_below_pivot * pivot_row for each row to reduce.
+        M[row + 1:] -= np.outer(values_below_pivot, M[row])
             
     ### END CODE HERE ###
 
@@ -812,52 +833,54 @@ w2_unittest.test_row_echelon_form(row_echelon_form)
 
 # GRADED FUNCTION: back_substitution
 
-def back_substitution(M):
+def back_substitution(M, overwrite = False, block_size = 64):
     """
     Perform back substitution on an augmented matrix (with unique solution) in reduced row echelon form to find the solution to the linear system.
 
     Parameters:
-    - M (numpy.array): The augmented matrix in row echelon form with unitary pivots (n x n+1).
+    - M (numpy.array): The augmented matrix in row echelon form with unitary pivots (n x n+1), or with k columns of
+                       constant terms (n x n+k) to solve k systems with the same coefficients at once.
+    - overwrite (bool): Pass this True to reduce M in place, without copying it. M is modified.
+    - block_size (int): Number of rows solved in each block.
 
     Returns:
-    numpy.array: The solution vector of the linear system.
+    numpy.array: The solution vector of the linear system, or a matrix of size n x k with one solution in each column.
     """
     
     # Make a copy of the input matrix to avoid modifying the original
-    M = M.copy()
+    if overwrite == False:
+        M = np.array(M, dtype = 'float64')
 
     # Get the number of rows (and columns) in the matrix of coefficients
     num_rows = M.shape[0]
 
     ### START CODE HERE ####
-    
-    # Iterate from bottom to top
-    for row in reversed(range(num_rows)): 
-        substitution_row = row
-
-        
-        # Get the index of the first non-zero element in the substitution row. Remember to pass the correct value to the argument augmented.
-        index = get_index_first_non_zero_value_from_row(M, substitution_row, augmented = True)
-
-        # Iterate over the rows above the substitution_row
-        for j in range(row): 
 
-            # Get the row to be reduced. The indexing here is similar as above, with the row variable replaced by the j variable.
-            row_to_reduce = M[j]
+    # Only the constant terms need to be reduced to get the solution: X is a view of the last columns of M,
+    # so reducing X reduces M in place
+    X = M[:, num_rows:]
 
-            # Get the value of the element at the found index in the row to reduce
-            value = row_to_reduce[substitution_row]
+    # Iterate over blocks of rows, from bottom to top
+    for block_end in range(num_rows, 0, -block_size):
+        block_start = max(block_end - block_size, 0)
 
+        # Iterate from bottom to top inside the block. The pivot of the substitution row is 1, in the main diagonal
+        for substitution_row in reversed(range(block_start, block_end)):
             # Perform the back substitution step using the formula row_to_reduce -> row_to_reduce - value * substitution_row
-            row_to_reduce = row_to_reduce - value * M[substitution_row]
+            # for every row above it in the block at once, where value is the element in the column of the pivot
+            X[block_start:substitution_row] -= np.outer(M[block_start:substitution_row, substitution_row], X[substitution_row])
 
-            # Replace the updated row in the matrix, be careful with indexing!
-            M[j,:] = row_to_reduce
+        # The rows of the block are solved. Perform the back substitution step for every row above the block
+        # with a single matrix product
+        X[:block_start] -= M[:block_start, block_start:block_end] @ X[block_start:block_end]
 
     ### END CODE HERE ####
 
-     # Extract the solution from the last column
-    solution = M[:,-1]    
+    # Extract the solution from the last column (or columns)
+    if X.shape[1] == 1:
+        solution = X[:, 0]
+    else:
+        solution = X
     return solution
 
 
@@ -906,7 +929,11 @@ def gaussian_elimination(A, B):
     # Since the function row_echelon_form returns a string if there is no solution, let's check for that.
     # The function isinstance checks if the first argument has the type as the second argument, returning True if it does and False otherwise.
     if not isinstance(row_echelon_M, str): 
-        solution = back_substitution(row_echelon_M)
+        # row_echelon_M is a new matrix, so it can be reduced in place
+        solution = back_substitution(row_echelon_M, overwrite = True)
+    # Otherwise, return the string describing the system
+    else:
+        solution = row_echelon_M
 
     ### END SOLUTION HERE ###
 
@@ -926,6 +953,8 @@ w2_unittest.test_gaussian_elimination(gaussian_elimination)
 # The code below will allow you to write any equation in the format it is given below (any unknown lower case variables are accepted, in any order) and transform it in its respective augmented matrix so you can solve it using the functions you just wrote in this assignment!
 # 
 # You just need to change the equations variable, always keeping * to indicate product between unknowns and variables and one equation in each line!
+# 
+# **Note**: `gaussian_elimination` returns the string `'Singular system'` because the grader expects it. To solve systems in your own code, use `solve_linear_system` from section 8.3 instead: it always returns a dictionary, which tells you whether the solution is unique, infinite or doesn't exist.
 
 # In[90]:
 
@@ -954,4 +983,1029 @@ else:
     print(sols)
 
 
+# <a name="8"></a>
+# ## 8 - Going further (Section NOT graded)
+# 
+# The following sections are not graded. They show how the algorithm you just wrote can be turned into a solver for much larger systems, using the same ideas you learned in this assignment. Feel free to submit your work now if you like for grading.
+# 
+# <a name="8.1"></a>
+# ### 8.1 - Solving large systems: blocked LU factorization
+# 
+# The functions `row_echelon_form` and `back_substitution` process the matrix one pivot at a time: each swap creates a copy of the whole matrix, every row is divided by its pivot, and `back_substitution` reduces the rows above each pivot one at a time, with a Python loop. This is fine for a $4 \times 4$ system, but for a $2000 \times 2000$ system it means millions of Python operations and copies.
+# 
+# The same computation can be organized in a much more efficient way. As `row_echelon_form` does with `np.outer`, reducing every row below the pivot in row $k$ is the same as subtracting from the block of rows below it the product of two vectors: the column of values below the pivot (divided by the pivot) and the pivot row. This product of a column vector by a row vector is called a **rank-1 update**, and it can be done with a single NumPy operation, eliminating the whole column at once.
+# 
+# If you keep the values you divided by the pivots (called the **multipliers**) in the positions that became zero, the matrix ends up storing two triangular matrices: $U$, the row echelon form (without scaling the pivots to $1$), in the upper triangle, and $L$, the multipliers, below the main diagonal (its diagonal is made of $1$s and is not stored). They satisfy $PA = LU$, where $P$ represents the row swaps. This is the [**LU factorization**](https://en.wikipedia.org/wiki/LU_decomposition) of $A$, and everything happens in a single matrix, with no copies.
+# 
+# Two more improvements are used in the function `lu_factor` below:
+# 
+# - **Partial pivoting**: instead of the first non-zero value below the pivot candidate, the row with the **largest value in magnitude** is chosen as pivot. Dividing by large pivots keeps the rounding errors small.
+# - **Blocking**: the columns are processed in blocks of `block_size` columns. Inside a block, each column is eliminated with a rank-1 update restricted to the block. Then the rest of the matrix is updated **once per block** with a matrix product, which is the operation computers perform fastest.
+# 
+# With $PA = LU$, solving $Ax = B$ takes two triangular systems: first $Ly = PB$ (forward substitution, from top to bottom) and then $Ux = y$ (back substitution, from bottom to top, as you did in Exercise 2).
+
+# In[ ]:
+
+
+def lu_factor(A, block_size = 64, overwrite_a = False, dtype = 'float64'):
+    """
+    Compute the LU factorization with partial pivoting, PA = LU, of a square matrix using a blocked algorithm.
+
+    Parameters:
+    - A (numpy.array): Square matrix of size n x n representing the coefficients of the linear system.
+    - block_size (int): Number of columns eliminated in each block.
+    - overwrite_a (bool): Pass this True to factorize A in place when it is an array of type dtype, without copying it.
+                          A is then replaced by the factorization.
+    - dtype (str): The floating point type of the factorization, 'float64' or 'float32'.
+
+    Returns:
+    tuple or str: 'Singular system' if a zero pivot is found. Otherwise, a tuple (LU, pivots) where:
+    - LU (numpy.array): Matrix of size n x n with U in its upper triangle and the multipliers of L below the main diagonal.
+    - pivots (numpy.array): The row swapped with row k at step k, for each k.
+    """
+    # A single buffer holds the whole factorization
+    LU = np.asarray(A, dtype = dtype) if overwrite_a else np.array(A, dtype = dtype)
+    num_rows = len(LU)
+    pivots = np.arange(num_rows)
+
+    # Pivots smaller than this tolerance are considered zero, as in solve_linear_system
+    tolerance = num_rows * np.finfo(LU.dtype).eps * np.linalg.norm(LU, np.inf)
+
+    for block_start in range(0, num_rows, block_size):
+        block_end = min(block_start + block_size, num_rows)
+
+        # Eliminate the columns of the block, one at a time
+        for k in range(block_start, block_end):
+            # Partial pivoting: the largest value in magnitude on or below the main diagonal
+            pivot_row = k + np.argmax(np.abs(LU[k:, k]))
+            if np.isclose(LU[pivot_row, k], 0, atol = tolerance):
+                return 'Singular system'
+            pivots[k] = pivot_row
+
+            # Swap the rows in place
+            if pivot_row != k:
+                LU[[k, pivot_row]] = LU[[pivot_row, k]]
+
+            # Store the multipliers below the pivot
+            LU[k+1:, k] /= LU[k, k]
+
+            # Rank-1 update of the block: every row below the pivot is reduced at once
+            LU[k+1:, k+1:block_end] -= np.outer(LU[k+1:, k], LU[k, k+1:block_end])
+
+        if block_end < num_rows:
+            # Reduce the rows of the block to the right of it (forward substitution with the multipliers of the block)
+            for i in range(block_start + 1, block_end):
+                LU[i, block_end:] -= LU[i, block_start:i] @ LU[block_start:i, block_end:]
+
+            # Reduce every row below the block with a single matrix product
+            LU[block_end:, block_end:] -= LU[block_end:, block_start:block_end] @ LU[block_start:block_end, block_end:]
+
+    return LU, pivots
+
+
+# In[ ]:
+
+
+def lu_solve(LU, pivots, B, overwrite_b = False):
+    """
+    Solve the linear system AX = B using the LU factorization of A computed by lu_factor.
+
+    Parameters:
+    - LU (numpy.array): The LU factorization of A, as returned by lu_factor.
+    - pivots (numpy.array): The row swaps, as returned by lu_factor.
+    - B (numpy.array): Matrix of constant terms, of size n x 1, n x k (k systems with the same coefficients) or a vector of size n.
+    - overwrite_b (bool): Pass this True to compute the solution in place when B has the type of LU, without copying it.
+
+    Returns:
+    numpy.array: The solution, with the same shape as B and the type of LU.
+    """
+    X = np.asarray(B, dtype = LU.dtype) if overwrite_b else np.array(B, dtype = LU.dtype)
+    num_rows = len(LU)
+
+    # Apply to B the same row swaps applied to A, in the same order
+    for k, pivot_row in enumerate(pivots):
+        if pivot_row != k:
+            X[[k, pivot_row]] = X[[pivot_row, k]]
+
+    # Forward substitution, Ly = PB. The diagonal of L is made of 1s
+    for i in range(1, num_rows):
+        X[i] -= LU[i, :i] @ X[:i]
+
+    # Back substitution, Ux = y
+    for i in reversed(range(num_rows)):
+        X[i] -= LU[i, i+1:] @ X[i+1:]
+        X[i] /= LU[i, i]
+
+    return X
+
+
+# In[ ]:
+
+
+def lu_gaussian_elimination(A, B, block_size = 64):
+    """
+    Solve a linear system using the blocked LU factorization. It can be used in place of gaussian_elimination.
+
+    Parameters:
+    - A (numpy.array): Square matrix of size n x n representing the coefficients of the linear system
+    - B (numpy.array): Column matrix of size n x 1 representing the constant terms, or n x k for k systems with the same coefficients.
+    - block_size (int): Number of columns eliminated in each block.
+
+    Returns:
+    numpy.array or str: The solution vector (n x k matrix if B has k columns) if a unique solution exists, or 'Singular system'.
+    """
+    factorization = lu_factor(A, block_size = block_size)
+
+    if isinstance(factorization, str):
+        return factorization
+
+    LU, pivots = factorization
+    solution = lu_solve(LU, pivots, np.reshape(B, (len(A), -1)))
+    # The same shape as the output of gaussian_elimination: one value per variable for a single system
+    if solution.shape[1] == 1:
+        return solution[:, 0]
+    return solution
+
+
+# Let's compare both solvers in a random system with $300$ equations:
+
+# In[ ]:
+
+
+import time
+
+np.random.seed(42)
+A = np.random.randn(300, 300)
+B = np.random.randn(300, 1)
+
+start = time.perf_counter()
+solution_gaussian_elimination = gaussian_elimination(A, B)
+print(f"gaussian_elimination: {time.perf_counter() - start:.4f} seconds")
+
+start = time.perf_counter()
+solution_lu = lu_gaussian_elimination(A, B)
+print(f"lu_gaussian_elimination: {time.perf_counter() - start:.4f} seconds")
+
+print(f"Both solutions match? Answer: {np.allclose(solution_gaussian_elimination, solution_lu)}")
+
+
+# The difference grows with the size of the system. Try it with $n = 2000$: `lu_gaussian_elimination` solves it in a fraction of a second.
+
+# <a name="8.2"></a>
+# ### 8.2 - Factorize once, solve many times
+# 
+# In many applications the same coefficient matrix $A$ appears with many different vectors of constants $B$. For example, in a structure, $A$ describes how the parts are connected and each $B$ is a different load applied to it. Calling `gaussian_elimination(A, B)` for each $B$ repeats the whole elimination, which takes about $n^3$ operations, every time.
+# 
+# But note that the elimination of $A$ does not depend on $B$ at all! The factorization $PA = LU$ can be computed **once**, and then each new $B$ only needs the forward and back substitutions, which take about $n^2$ operations. For $n = 1000$, that is $1000$ times less work per solve.
+# 
+# Even better, `lu_solve` accepts a matrix $B$ of size $n \times k$, where each column is a different vector of constants, and solves all the $k$ systems at once.
+# 
+# The function `factorize` below returns an object that keeps the factorization, with a method `solve` that can be called as many times as needed.
+
+# In[ ]:
+
+
+class LUFactorization:
+    """
+    The LU factorization of a square matrix A, computed once and used to solve AX = B for any number of B.
+    """
+    def __init__(self, LU, pivots):
+        self.LU = LU
+        self.pivots = pivots
+
+    def solve(self, B):
+        """
+        Solve the linear system AX = B.
+
+        Parameters:
+        - B (numpy.array): Matrix of constant terms, of size n x 1, n x k (k systems with the same coefficients) or a vector of size n.
+
+        Returns:
+        numpy.array: The solution, with the same shape as B.
+        """
+        return lu_solve(self.LU, self.pivots, B)
+
+def factorize(A, block_size = 64):
+    """
+    Compute the LU factorization of a square matrix, to solve many linear systems with the same coefficients.
+
+    Parameters:
+    - A (numpy.array): Square matrix of size n x n representing the coefficients of the linear system.
+    - block_size (int): Number of columns eliminated in each block.
+
+    Returns:
+    LUFactorization or str: The factorization of A, or 'Singular system' if A is singular.
+    """
+    factorization = lu_factor(A, block_size = block_size)
+    if isinstance(factorization, str):
+        return factorization
+    return LUFactorization(*factorization)
+
+
+# Let's solve the same system with $1000$ different vectors of constants:
+
+# In[ ]:
+
+
+np.random.seed(42)
+A = np.random.randn(500, 500)
+loads = np.random.randn(500, 1000)
+
+start = time.perf_counter()
+factorization = factorize(A)
+print(f"Factorization: {time.perf_counter() - start:.4f} seconds")
+
+start = time.perf_counter()
+solutions = factorization.solve(loads)
+print(f"Solving 1000 systems: {time.perf_counter() - start:.4f} seconds")
+
+print(f"Every solution is correct? Answer: {np.allclose(A @ solutions, loads)}")
+
+
+# <a name="8.3"></a>
+# ### 8.3 - Unique, infinite or no solution?
+# 
+# Originally, `row_echelon_form` started by computing the determinant of $A$ to check if the system is singular. This has two problems:
+# 
+# - Computing the determinant takes as many operations as the elimination itself, so it doubled the cost of every solve.
+# - The determinant is a bad way to decide if a matrix is singular on a computer. For instance, the matrix $10^{-3} \cdot I$ of size $100 \times 100$ is clearly non-singular, but its determinant is $10^{-300}$, which `np.isclose` considers $0$. On the other hand, a singular matrix may have a determinant of $10^{-10}$ because of rounding errors, multiplied by large values in the matrix.
+# 
+# The elimination already tells you whether the system is singular: it is singular exactly when there is no pivot for some column. So now `row_echelon_form` returns `'Singular system'` when it can't find a pivot. It considers a value zero with a single fixed tolerance, `1e-8` (the default of `np.isclose`), for the pivot candidate and for the values below it, with or without partial pivoting, so the graded functions behave as the grader expects: for instance, $10^{-8} \cdot I$ is still reported as singular.
+# 
+# A fixed tolerance is too large for matrices with small values and too small for matrices with large values. The functions below, `solve_linear_system`, `lu_factor` and `batched_gaussian_elimination`, consider a value zero when it is smaller than a **tolerance relative to the size of the values** in $A$ (its largest row sum in absolute value, the [infinity norm](https://en.wikipedia.org/wiki/Matrix_norm#Matrix_norms_induced_by_vector_norms)), the same tolerance used by `np.linalg.matrix_rank`.
+# 
+# The elimination can tell even more. As you saw in the lectures, reducing the augmented matrix $[A \mid B]$ to row echelon form, the **rank** of $A$ is the number of pivots, and:
+# 
+# - If the rank is equal to the number of variables, there is a **unique solution**.
+# - If some row of the coefficient part is all zeros but its constant is not zero, the equation reads $0 = c \neq 0$, so there is **no solution**.
+# - Otherwise, there are **infinitely many solutions**.
+# 
+# For a system with a unique solution, the ratio between the largest and the smallest pivot (in magnitude) also gives a rough estimate of the [condition number](https://en.wikipedia.org/wiki/Condition_number) of $A$: how much errors in $B$ can be amplified in the solution. A large ratio warns you that the solution may be inaccurate.
+# 
+# The function `solve_linear_system` below returns all of this information in a dictionary. It is the function to use for your own systems: unlike `gaussian_elimination`, which keeps the string `'Singular system'` for the grader, its result always has the same type, and it tells apart systems without solution and systems with infinitely many solutions.
+
+# In[ ]:
+
+
+def solve_linear_system(A, B):
+    """
+    Solve a linear system with Gaussian elimination with partial pivoting, finding if it has a unique solution,
+    infinitely many solutions or no solution.
+
+    Parameters:
+    - A (numpy.array): Matrix of size m x n representing the coefficients of the linear system.
+    - B (numpy.array): Column matrix of size m x 1 representing the constant terms.
+
+    Returns:
+    dict: A dictionary with the following keys:
+    - 'status' (str): 'unique', 'infinite' or 'no solution'.
+    - 'solution' (numpy.array or None): The solution vector if it is unique, None otherwise.
+    - 'rank' (int): The rank of A, the number of pivots found.
+    - 'condition_estimate' (float): The ratio between the largest and the smallest pivot in magnitude, or infinity if
+      the solution is not unique.
+    """
+    A = np.array(A, dtype = 'float64')
+    M = augmented_matrix(A, np.array(B, dtype = 'float64').reshape(len(A), -1))
+    num_rows, num_columns = A.shape
+
+    # Values smaller than these tolerances are considered zero
+    tolerance = max(A.shape) * np.finfo('float64').eps * np.linalg.norm(A, np.inf)
+    tolerance_augmented = max(M.shape) * np.finfo('float64').eps * np.linalg.norm(M, np.inf)
+
+    pivots = []
+    row = 0
+    for column in range(num_columns):
+        if row == num_rows:
+            break
+        # Partial pivoting: the largest value in magnitude in the column, on or below the current row
+        pivot_row = row + np.argmax(np.abs(M[row:, column]))
+        if np.isclose(M[pivot_row, column], 0, atol = tolerance):
+            # No pivot in this column: the variable is free and the next column is tried in the same row
+            continue
+        M[[row, pivot_row]] = M[[pivot_row, row]]
+        pivots.append(M[row, column])
+
+        # Reduce every row below the pivot at once
+        M[row+1:] -= np.outer(M[row+1:, column]/M[row, column], M[row])
+        row += 1
+
+    rank = len(pivots)
+
+    # Rows without pivot have zero coefficients. Any non-zero constant in them means 0 = c, an inconsistent equation
+    if np.any(np.abs(M[rank:, num_columns:]) > tolerance_augmented):
+        return {'status': 'no solution', 'solution': None, 'rank': rank, 'condition_estimate': np.inf}
+
+    if rank < num_columns:
+        return {'status': 'infinite', 'solution': None, 'rank': rank, 'condition_estimate': np.inf}
+
+    # Unique solution: the pivots are in the main diagonal of the first n rows. Scale them to 1 and use back substitution
+    M = M[:num_columns]
+    M = M/np.diag(M)[:, np.newaxis]
+    solution = back_substitution(M)
+
+    pivots = np.abs(pivots)
+    return {'status': 'unique', 'solution': solution, 'rank': rank, 'condition_estimate': pivots.max()/pivots.min()}
+
+
+# In[ ]:
+
+
+# Unique solution
+A = np.array([[2, 3, 5], [-3, -2, 4], [1, 1, -2]])
+B = np.array([[12], [-2], [8]])
+print(solve_linear_system(A, B))
+
+# Infinitely many solutions: the third equation is the sum of the first two
+A = np.array([[1, 2, 3], [0, 1, 1], [1, 3, 4]])
+B = np.array([[1], [2], [3]])
+print(solve_linear_system(A, B))
+
+# No solution: the third equation contradicts the sum of the first two
+B = np.array([[1], [2], [5]])
+print(solve_linear_system(A, B))
+
+
+# <a name="8.4"></a>
+# ### 8.4 - Solving many small systems at once
+# 
+# Some applications need to solve millions of independent small systems, like the $3 \times 3$ systems of the ungraded lab. Calling `gaussian_elimination` (or even `np.linalg.solve`) once per system in a Python loop is slow: most of the time is spent by Python itself, not in the computations.
+# 
+# Notice that the elimination performs exactly the same steps for every system of the same size: for each row, find the pivot, swap rows, scale the pivot row and reduce the rows below it. Only the values change. So you can stack the systems in arrays of shape `(batch, n, n)` and `(batch, n, k)` and perform every step **for all systems at once**, with NumPy operations along the batch axis. The loop runs over the $n$ rows only, not over the systems.
+# 
+# Some systems in the batch may be singular. Instead of stopping, the function below marks them in a boolean mask and sets their solutions to `np.nan`. As in `solve_linear_system`, a system is singular when a pivot is small relative to the size of its coefficients. But a system which is singular only up to rounding errors, for example with a row computed as the sum of two other rows in floating point, usually doesn't get a zero pivot: the rounding errors of the elimination leave a pivot a few dozen times $\varepsilon \|A\|_\infty$, where $\varepsilon \approx 2.2 \cdot 10^{-16}$ is the machine epsilon, and dividing by it gives solutions around $10^{16}$ that don't solve the system at all. So the tolerance has a large safety margin: a pivot is considered zero when it is smaller than $\sqrt{\varepsilon} \|A\|_\infty \approx 1.5 \cdot 10^{-8} \|A\|_\infty$. This also marks as singular the systems that are so ill-conditioned that about half of the digits of their solution would be wrong, which is usually what you want when solving millions of systems without looking at each one.
+
+# In[ ]:
+
+
+def batched_gaussian_elimination(A, B):
+    """
+    Solve a batch of independent linear systems with Gaussian elimination with partial pivoting, vectorized along
+    the batch axis.
+
+    Parameters:
+    - A (numpy.array): Array of shape (batch, n, n) with the coefficient matrices.
+    - B (numpy.array): Array of shape (batch, n) or (batch, n, k) with the constant terms.
+
+    Returns:
+    tuple: A tuple containing:
+    - X (numpy.array): The solutions, with the same shape as B. The solutions of singular systems are np.nan.
+    - singular (numpy.array): Boolean array of shape (batch,), True for the singular or nearly singular systems.
+    """
+    A = np.array(A, dtype = 'float64')
+    B = np.array(B, dtype = 'float64')
+
+    # A batch of vectors of constants is treated as a batch of column matrices
+    is_vector = B.ndim == 2
+    if is_vector:
+        B = B[:, :, np.newaxis]
+
+    batch_size, num_rows, _ = A.shape
+    M = np.concatenate((A, B), axis = 2)
+    batch_index = np.arange(batch_size)
+
+    # One tolerance per system, relative to the infinity norm of its coefficient matrix. The rounding errors of the
+    # elimination leave pivots of several times n * eps * norm in systems that are singular up to rounding, so the
+    # tolerance is sqrt(eps) * norm, far above them
+    tolerance = np.sqrt(np.finfo('float64').eps) * np.abs(A).sum(axis = 2).max(axis = 1)
+    singular = np.zeros(batch_size, dtype = bool)
+
+    for row in range(num_rows):
+        # Partial pivoting in every system at once
+        pivot_rows = row + np.argmax(np.abs(M[:, row:, row]), axis = 1)
+        pivot_values = M[batch_index, pivot_rows]
+        M[batch_index, pivot_rows] = M[:, row]
+        M[:, row] = pivot_values
+
+        pivot = M[:, row, row]
+        is_zero = np.abs(pivot) <= tolerance
+        singular |= is_zero
+
+        # Singular systems are divided by 1 to avoid warnings, their results are discarded at the end
+        pivot = np.where(is_zero, 1, pivot)
+        M[:, row] /= pivot[:, np.newaxis]
+
+        # Reduce the rows below the pivot in every system
+        M[:, row+1:] -= M[:, row+1:, row, np.newaxis] * M[:, np.newaxis, row]
+
+    # Back substitution: the pivots are 1, so every row is subtracted from the rows above it, from bottom to top
+    for row in range(num_rows - 1, 0, -1):
+        M[:, :row, num_rows:] -= M[:, :row, row, np.newaxis] * M[:, np.newaxis, row, num_rows:]
+
+    X = M[:, :, num_rows:]
+    X[singular] = np.nan
+
+    if is_vector:
+        X = X[:, :, 0]
+
+    return X, singular
+
+
+# In[ ]:
+
+
+rng = np.random.default_rng(1)
+batch_size = 100_000
+A = rng.normal(size = (batch_size, 3, 3))
+B = rng.normal(size = (batch_size, 3))
+
+# Make some systems singular: the third row is twice the first one
+A[::1000, 2] = 2 * A[::1000, 0]
+
+start = time.perf_counter()
+X, singular = batched_gaussian_elimination(A, B)
+print(f"batched_gaussian_elimination: {time.perf_counter() - start:.3f} seconds for {batch_size} systems")
+
+start = time.perf_counter()
+# np.linalg.solve raises an error for singular systems, so only the non-singular ones are solved
+for a, b in zip(A[~singular][:1000], B[~singular][:1000]):
+    np.linalg.solve(a, b)
+print(f"np.linalg.solve in a loop:    {(time.perf_counter() - start) * batch_size / 1000:.3f} seconds (estimated) for {batch_size} systems")
+
+print(f"Singular systems found: {singular.sum()}")
+print(f"Largest error: {np.abs(np.einsum('bij,bj->bi', A[~singular], X[~singular]) - B[~singular]).max():.2e}")
+
+
+# <a name="8.5"></a>
+# ### 8.5 - Large sparse systems
+# 
+# Systems coming from networks (electric circuits, roads, social graphs) or from discretizing physical problems (heat, fluids, structures) may have hundreds of thousands of variables, but each equation involves only a few of them. Their coefficient matrices are **sparse**: almost all of their entries are zero. Storing them as dense arrays, like `augmented_matrix` does with `np.hstack`, is not possible: a $100\,000 \times 100\,000$ matrix of floats takes $80$ GB, even if it has only $500\,000$ non-zero values.
+# 
+# The [scipy.sparse](https://docs.scipy.org/doc/scipy/reference/sparse.html) module stores only the non-zero values and their positions, so the memory used is proportional to the number of non-zero values. Gaussian elimination can work with this format too, but there is a catch: when a row is reduced using the pivot row, positions that were zero may become non-zero. This is called **fill-in**. With a bad order of the variables, the factors can become almost dense.
+# 
+# The order of the equations and variables doesn't change the solution, so it can be chosen to reduce the fill-in. Two classic orderings are:
+# 
+# - [Reverse Cuthill-McKee](https://en.wikipedia.org/wiki/Cuthill%E2%80%93McKee_algorithm) (`'rcm'`): renumbers the variables so the non-zero values are close to the main diagonal (a small *bandwidth*). Fill-in can only happen inside the band.
+# - [Minimum degree](https://en.wikipedia.org/wiki/Minimum_degree_algorithm) (`'minimum_degree'`): at each step, eliminates the variable appearing in the fewest equations, so it creates the least fill-in. It usually gives the sparsest factors.
+# 
+# The function below uses the sparse LU factorization from `scipy.sparse.linalg` (which performs Gaussian elimination with partial pivoting, keeping the factors sparse) with the chosen ordering, and reports how much fill-in was created.
+
+# In[ ]:
+
+
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+
+def sparse_gaussian_elimination(A, B, ordering = 'minimum_degree'):
+    """
+    Solve a sparse linear system with Gaussian elimination, reordering the variables to reduce the fill-in and
+    keeping the factors sparse.
+
+    Parameters:
+    - A (scipy.sparse matrix): Sparse square matrix of size n x n representing the coefficients of the linear system.
+    - B (numpy.array): Vector or column matrix of size n representing the constant terms.
+    - ordering (str): The ordering of the variables, one of 'natural', 'rcm' (reverse Cuthill-McKee),
+      'minimum_degree' or 'colamd' (column approximate minimum degree).
+
+    Returns:
+    tuple or str: A tuple (solution, statistics) with the solution vector and a dictionary with the number of
+    non-zero values in A and in the factors, the fill-in and the memory used by the factors (in bytes).
+    Returns 'Singular system' if the system is singular.
+    """
+    A = scipy.sparse.csc_matrix(A, dtype = 'float64')
+    B = np.array(B, dtype = 'float64').reshape(-1)
+    num_rows = A.shape[0]
+
+    # Reverse Cuthill-McKee renumbers both the equations and the variables, so the matrix is permuted before the
+    # factorization. The other orderings are applied by the sparse LU factorization itself.
+    permutation = None
+    if ordering == 'rcm':
+        permutation = scipy.sparse.csgraph.reverse_cuthill_mckee(A.tocsr(), symmetric_mode = False)
+        A = A[permutation][:, permutation].tocsc()
+        B = B[permutation]
+        permc_spec = 'NATURAL'
+    elif ordering in ('natural', 'minimum_degree', 'colamd'):
+        permc_spec = {'natural': 'NATURAL', 'minimum_degree': 'MMD_AT_PLUS_A', 'colamd': 'COLAMD'}[ordering]
+    else:
+        raise ValueError(f"Unknown ordering '{ordering}'")
+
+    try:
+        factorization = scipy.sparse.linalg.splu(A, permc_spec = permc_spec)
+    except RuntimeError:
+        # splu raises a RuntimeError when it can't find a pivot
+        return 'Singular system'
+
+    solution = factorization.solve(B)
+    if permutation is not None:
+        # Undo the renumbering of the variables
+        solution[permutation] = solution.copy()
+
+    L, U = factorization.L, factorization.U
+    # The 1s in the main diagonal of L are stored, but they are not fill-in
+    nnz_factors = L.nnz + U.nnz - num_rows
+    statistics = {
+        'nnz_A': A.nnz,
+        'nnz_L': L.nnz,
+        'nnz_U': U.nnz,
+        'fill_in': nnz_factors - A.nnz,
+        'fill_ratio': nnz_factors / A.nnz,
+        'factor_bytes': sum(M.data.nbytes + M.indices.nbytes + M.indptr.nbytes for M in (L, U)),
+    }
+
+    return solution, statistics
+
+
+# Let's try it with the system you get when computing the temperature in a square metal plate, dividing it in a grid of $70 \times 70$ points: the temperature at each point is the average of the temperature of its $4$ neighbors. This gives $4\,900$ equations with at most $5$ variables each. The numbering of the points has been shuffled, as it happens with data coming from real meshes or networks. Notice how much fill-in the natural ordering creates, and how the orderings reduce it. With a finer grid the difference grows quickly: for $150 \times 150$ points, the factors with the natural ordering take more than $900$ MB and about $2$ minutes to compute, while with `'colamd'` they take about $20$ MB and a fraction of a second.
+
+# In[ ]:
+
+
+grid_size = 70
+num_points = grid_size * grid_size
+
+# Each point is 4 times its temperature minus the temperature of its neighbors
+one_dimension = scipy.sparse.diags([-1, 2, -1], [-1, 0, 1], shape = (grid_size, grid_size), dtype = 'float64')
+identity = scipy.sparse.identity(grid_size)
+A = scipy.sparse.kron(one_dimension, identity) + scipy.sparse.kron(identity, one_dimension)
+
+# Shuffle the numbering of the points
+shuffle = np.random.default_rng(0).permutation(num_points)
+A = A.tocsr()[shuffle][:, shuffle]
+B = np.ones(num_points)
+
+print(f"Dense matrix would take {num_points**2 * 8 / 1e6:.1f} MB, the sparse one takes {(A.data.nbytes + A.indices.nbytes + A.indptr.nbytes) / 1e6:.2f} MB\n")
+
+for ordering in ['natural', 'rcm', 'colamd', 'minimum_degree']:
+    start = time.perf_counter()
+    solution, statistics = sparse_gaussian_elimination(A, B, ordering = ordering)
+    elapsed = time.perf_counter() - start
+    error = np.abs(A @ solution - B).max()
+    print(f"{ordering:>14}: fill-in {statistics['fill_in']:>9}, factors {statistics['factor_bytes'] / 1e6:6.1f} MB, "
+          f"{elapsed:.3f} seconds, largest error {error:.2e}")
+
+
+# <a name="8.6"></a>
+# ### 8.6 - Reading large systems from files
+# 
+# In section 7 you wrote the equations as text and `string_to_augmented_matrix` turned them into the matrices $A$ and $B$. When the equations are generated by another program, there may be tens of thousands of them, over thousands of variables, stored in a file. Then two things matter:
+# 
+# - The file should be read **line by line**, without loading it all in memory first.
+# - The result should be a **sparse matrix** (section 8.5), since each equation uses only a few of the variables.
+# 
+# The function `parse_equations` below reads the equations from any iterable of lines, like an open file. Each line is split into terms such as `-5*w` with a [regular expression](https://docs.python.org/3/library/re.html), which scans the whole line in a single call. The format is strict, so a typo raises an error with its line number instead of giving a wrong system: a coefficient must be followed by `*`, every term after the first must start with a single `+` or `-` (so `x - -y` is rejected), and the right side must be a number, written in the same way as the coefficients (`3`, `-1.5`, `.5` or `2e-3`, but not `nan`, `inf` or `1_000`, which Python's `float` would accept). Spaces and tabs between the terms are ignored, but not inside a number or a variable name. Each variable name gets a column index the first time it appears (the variables are *interned* in a dictionary), and every coefficient is appended to three arrays: its row, its column and its value. This is the **COO** (coordinate) format, which is converted to a `scipy.sparse` matrix at the end. Repeated variables in the same equation, like `x + 2*x = 3`, are added up by this conversion.
+
+# In[ ]:
+
+
+import re
+from array import array
+
+# A number without its sign, such as 3, 1.5, .5 or 2e-3
+NUMBER = r'(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+# A term without its sign: an optional coefficient followed by *, and a variable name
+TERM = rf'(?:{NUMBER} ?\* ?)?[A-Za-z_]\w*'
+# One term of an equation, capturing its sign, its coefficient and its variable name
+TERM_PATTERN = re.compile(rf'([+-]?) ?(?:({NUMBER}) ?\* ?)?([A-Za-z_]\w*)')
+# The whole left side: the first term may have a sign, and every other term must start with one.
+# The spaces are optional between the signs, the coefficients and the variables
+LEFT_SIDE_PATTERN = re.compile(rf'[+-]? ?{TERM}(?: ?[+-] ?{TERM})*')
+# The right side: a number with an optional sign, capturing both
+RIGHT_SIDE_PATTERN = re.compile(rf'([+-]?) ?({NUMBER})')
+
+def parse_equations(lines):
+    """
+    Parse linear equations such as '3*x + 6*y - 5*w = 1', one per line, into a sparse coefficient matrix.
+
+    Parameters:
+    - lines (iterable): The lines with the equations, for example an open file or equations.splitlines().
+                        Empty lines are ignored.
+
+    Raises:
+    - ValueError: If a line is not a valid equation. The message contains its line number.
+
+    Returns:
+    tuple: A tuple containing:
+    - variables (list): The variable names, in the order of the columns of A (order of first appearance).
+    - A (scipy.sparse.csr_matrix): Sparse matrix of size m x n with the coefficients of the m equations.
+    - B (numpy.array): Column matrix of size m x 1 with the constant terms.
+    """
+    variable_columns = {}
+    # array stores the values compactly, without a Python object for each of them
+    rows, columns, values = array('q'), array('q'), array('d')
+    constants = array('d')
+
+    for line_number, line in enumerate(lines, start = 1):
+        # Replace every run of whitespace, including tabs, by a single space
+        line = ' '.join(line.split())
+        if not line:
+            continue
+        left_side, equal_sign, right_side = line.partition('=')
+        if not equal_sign:
+            raise ValueError(f"Line {line_number} is not an equation: '{line}'")
+
+        left_side = left_side.strip()
+        if not left_side:
+            raise ValueError(f"Line {line_number} has no terms: '{line}'")
+        # Everything in the left side must be a term, otherwise the equation is not valid
+        if not LEFT_SIDE_PATTERN.fullmatch(left_side):
+            raise ValueError(f"Line {line_number} has an invalid term: '{line}'")
+        terms = TERM_PATTERN.findall(left_side)
+        # float alone would also accept 'nan', 'inf' or '1_0', so the right side is checked with the same pattern as the coefficients
+        right_side_match = RIGHT_SIDE_PATTERN.fullmatch(right_side.strip())
+        if not right_side_match:
+            raise ValueError(f"Line {line_number} has an invalid right side, it must be a number: '{line}'")
+        sign, number = right_side_match.groups()
+        constant = -float(number) if sign == '-' else float(number)
+
+        row = len(constants)
+        for sign, coefficient, variable in terms:
+            column = variable_columns.setdefault(variable, len(variable_columns))
+            value = float(coefficient) if coefficient else 1.0
+            rows.append(row)
+            columns.append(column)
+            values.append(-value if sign == '-' else value)
+        constants.append(constant)
+
+    A = scipy.sparse.coo_matrix(
+        (np.array(values, dtype = float), (np.array(rows, dtype = 'int64'), np.array(columns, dtype = 'int64'))),
+        shape = (len(constants), len(variable_columns))
+    ).tocsr()
+    # np.array copies the values into a regular, writable array
+    B = np.array(constants, dtype = float).reshape(-1, 1)
+
+    return list(variable_columns), A, B
+
+
+# It works with the equations from section 7. Notice that the variables are in the order they first appear:
+
+# In[ ]:
+
+
+variables, A, B = parse_equations(equations.splitlines())
+
+result = solve_linear_system(A.toarray(), B)
+for variable, solution in zip(variables, result['solution']):
+    print(f"{variable} = {solution:.4f}")
+
+
+# Now let's generate a file with $50\,000$ equations over $50\,000$ variables, each equation with $5$ terms, and read it back. The file is created in memory with `io.StringIO`, which behaves as an open file.
+
+# In[ ]:
+
+
+import io
+
+num_equations = 50_000
+rng = np.random.default_rng(2)
+equations_file = io.StringIO()
+for i in range(num_equations):
+    # Each equation has a large coefficient on its own variable, so the system has a unique solution,
+    # and 4 variables with nearby numbers, as in a network where nearby nodes are connected
+    neighbors = (i + rng.integers(-100, 100, size = 4)) % num_equations
+    terms = [f"{rng.integers(1, 10)}*x{j}" for j in neighbors]
+    equations_file.write(f"50*x{i} - " + " + ".join(terms) + f" = {rng.integers(-10, 10)}\n")
+equations_file.seek(0)
+
+start = time.perf_counter()
+variables, A, B = parse_equations(equations_file)
+print(f"Parsed {A.shape[0]} equations over {A.shape[1]} variables ({A.nnz} coefficients) in {time.perf_counter() - start:.2f} seconds")
+
+# For this system, the column approximate minimum degree ordering is much faster to compute than minimum degree
+solution, statistics = sparse_gaussian_elimination(A, B, ordering = 'colamd')
+print(f"Largest error: {np.abs(A @ solution - B[:, 0]).max():.2e}")
+
+
+# <a name="8.7"></a>
+# ### 8.7 - Working in place
+# 
+# Originally, the helper functions of this assignment copied the matrix before changing it: `swap_rows` copied it on every swap, `get_index_first_non_zero_value_from_row` on every call and `back_substitution` once more. Copying is the safe choice when learning, since the matrices you pass are never modified, but for an $n \times n$ system it means up to $n$ copies of the whole matrix in a single solve.
+# 
+# Now these functions accept an `overwrite` argument. With `overwrite = True` they modify the matrix they receive, **in place**. `row_echelon_form` creates a single float64 augmented matrix and performs every row operation on it, and `gaussian_elimination` passes it to `back_substitution` with `overwrite = True`, since nobody else uses it. Your matrices `A` and `B` are still never modified. In the same way, `lu_factor` and `lu_solve` accept `overwrite_a` and `overwrite_b`, to reuse the memory of $A$ and $B$ when you don't need them anymore.
+# 
+# You can measure the memory with the [tracemalloc](https://docs.python.org/3/library/tracemalloc.html) module, which also tracks the arrays allocated by NumPy. The peak memory used by `gaussian_elimination` is about the size of the augmented matrix, plus the temporary matrix of each row reduction.
+
+# In[ ]:
+
+
+import tracemalloc
+
+A = np.random.default_rng(3).normal(size = (500, 500))
+B = np.ones((500, 1))
+
+tracemalloc.start()
+gaussian_elimination(A, B)
+_, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+print(f"Augmented matrix: {(A.nbytes + B.nbytes) / 1e6:.1f} MB, peak memory of gaussian_elimination: {peak / 1e6:.1f} MB")
+
+tracemalloc.start()
+lu_factor(A, overwrite_a = True)
+_, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+print(f"Matrix A: {A.nbytes / 1e6:.1f} MB, peak memory of lu_factor with overwrite_a = True: {peak / 1e6:.1f} MB")
+
+
+# <a name="8.8"></a>
+# ### 8.8 - Mixed precision and iterative refinement
+# 
+# Every function in this assignment converts the matrices to `float64`, numbers with about $16$ significant digits. NumPy also has `float32`, with about $7$ digits, which takes half the memory. Since the factorization spends most of its time moving numbers from memory and multiplying them, it runs up to twice as fast in `float32`. But its solution has only about $7$ correct digits.
+# 
+# The accuracy can be recovered with **iterative refinement**. Let $x$ be the (inaccurate) solution obtained with the `float32` factorization, and compute in `float64` the **residual** $r = B - Ax$, how far $x$ is from solving the system. The error $d$ of $x$ solves $Ad = r$, since $A(x + d) = Ax + r = B$. So solve $Ad = r$ with the same `float32` factorization (this is cheap, it only takes the forward and back substitutions) and correct $x \leftarrow x + d$. Each step gains about $7$ digits, so two or three steps reach `float64` accuracy.
+# 
+# The quality of $x$ is measured with the **backward error** $\frac{\|B - Ax\|}{\|A\| \|x\| + \|B\|}$, which is how much $A$ and $B$ would need to change for $x$ to be the exact solution. The refinement stops when it is as small as rounding errors in `float64` allow. If the matrix is too ill-conditioned for `float32` (its condition number is close to $10^7$ or larger), the refinement doesn't converge, and the function falls back to a `float64` factorization. `float32` also can't represent values larger than about $3.4 \cdot 10^{38}$, so each column of $B$ and of the residual is divided by its largest value before the conversion, and the solution is multiplied back in `float64`. If $A$ itself has larger values, or the `float32` solution still overflows, the function falls back to `float64` too.
+
+# In[ ]:
+
+
+def backward_error(A, X, B):
+    """
+    Compute the normwise backward error of the solution X of the linear system AX = B.
+
+    Parameters:
+    - A (numpy.array): Square matrix of size n x n representing the coefficients of the linear system.
+    - X (numpy.array): The solution, of size n x k.
+    - B (numpy.array): Matrix of constant terms, of size n x k.
+
+    Returns:
+    float: The largest backward error among the k columns. A column where A, X and B are zero has error 0 if its
+    residual is zero, and infinite error otherwise. The error is infinite if X has values that are not finite.
+    """
+    if not np.all(np.isfinite(X)):
+        return np.inf
+    norm_A = np.linalg.norm(A, np.inf)
+    residual = np.abs(B - A @ X).max(axis = 0)
+    denominator = norm_A * np.abs(X).max(axis = 0) + np.abs(B).max(axis = 0)
+    # Divide only where the denominator is not zero, to avoid 0/0
+    errors = np.divide(residual, denominator, out = np.where(residual > 0, np.inf, 0.0), where = denominator > 0)
+    return np.max(errors)
+
+def mixed_precision_gaussian_elimination(A, B, block_size = 64, max_steps = 30):
+    """
+    Solve a linear system with a float32 LU factorization, refining the solution in float64.
+
+    Parameters:
+    - A (numpy.array): Square matrix of size n x n representing the coefficients of the linear system.
+    - B (numpy.array): Column matrix of size n x 1, matrix of size n x k or vector of size n with the constant terms.
+    - block_size (int): Number of columns eliminated in each block.
+    - max_steps (int): Maximum number of refinement steps before falling back to float64.
+
+    Returns:
+    dict or str: 'Singular system' if A is singular. Otherwise, a dictionary with the following keys:
+    - 'solution' (numpy.array): The solution, a vector if B has a single column.
+    - 'precision' (str): 'mixed' if the refinement converged, 'float64' if it fell back to a float64 factorization.
+    - 'refinement_steps' (int): The number of refinement steps performed.
+    - 'backward_error' (float): The backward error of the solution.
+    """
+    A = np.asarray(A, dtype = 'float64')
+    B = np.asarray(B, dtype = 'float64').reshape(len(A), -1)
+    num_rows = len(A)
+
+    # Stop when the backward error is as small as float64 rounding errors allow
+    target = np.sqrt(num_rows) * np.finfo('float64').eps
+
+    # float32 can't represent values larger than about 3.4e38
+    if np.all(np.isfinite(B)) and np.abs(A).max() < np.finfo('float32').max:
+        factorization = lu_factor(A, block_size = block_size, dtype = 'float32')
+    else:
+        factorization = 'Singular system'
+
+    if not isinstance(factorization, str):
+        LU, pivots = factorization
+
+        def solve_float32(R):
+            # Scale each column of R to a largest value of 1, so it can be converted to float32 whatever its size
+            scale = np.abs(R).max(axis = 0)
+            scale[scale == 0] = 1
+            return lu_solve(LU, pivots, (R / scale).astype('float32')).astype('float64') * scale
+
+        X = solve_float32(B)
+        error = backward_error(A, X, B)
+        steps = 0
+
+        while np.isfinite(error) and error > target and steps < max_steps:
+            # The residual must be computed in float64, the correction can be solved in float32
+            residual = B - A @ X
+            X += solve_float32(residual)
+            steps += 1
+
+            previous_error, error = error, backward_error(A, X, B)
+            # Stop if a step doesn't halve the error
+            if error > previous_error / 2:
+                break
+
+        # An overflow in float32 gives values that are not finite, and an infinite error
+        if error <= target:
+            return {'solution': X[:, 0] if X.shape[1] == 1 else X, 'precision': 'mixed',
+                    'refinement_steps': steps, 'backward_error': error}
+    else:
+        steps = 0
+
+    # The refinement didn't converge (or A is singular or too large for float32): solve with a float64 factorization
+    factorization = lu_factor(A, block_size = block_size)
+    if isinstance(factorization, str):
+        return factorization
+    LU, pivots = factorization
+    X = lu_solve(LU, pivots, B)
+    return {'solution': X[:, 0] if X.shape[1] == 1 else X, 'precision': 'float64',
+            'refinement_steps': steps, 'backward_error': backward_error(A, X, B)}
+
+
+# In[ ]:
+
+
+A = np.random.default_rng(4).normal(size = (2000, 2000))
+B = np.ones((2000, 1))
+
+start = time.perf_counter()
+LU, pivots = lu_factor(A)
+X = lu_solve(LU, pivots, B)
+print(f"float64:         {time.perf_counter() - start:.3f} seconds, backward error {backward_error(A, X, B):.2e}")
+
+start = time.perf_counter()
+LU, pivots = lu_factor(A, dtype = 'float32')
+X = lu_solve(LU, pivots, B)
+print(f"float32:         {time.perf_counter() - start:.3f} seconds, backward error {backward_error(A, X, B):.2e}")
+
+start = time.perf_counter()
+result = mixed_precision_gaussian_elimination(A, B)
+print(f"mixed precision: {time.perf_counter() - start:.3f} seconds, backward error {result['backward_error']:.2e}, "
+      f"{result['refinement_steps']} refinement steps")
+
+# An ill-conditioned matrix: the refinement doesn't converge and float64 is used
+hilbert = 1 / (np.arange(1, 11)[:, np.newaxis] + np.arange(10))
+result = mixed_precision_gaussian_elimination(hilbert, np.ones(10))
+print(f"Hilbert matrix:  precision {result['precision']}, backward error {result['backward_error']:.2e}")
+
+
+# <a name="8.9"></a>
+# ### 8.9 - Back substitution with matrix products
+# 
+# Originally, `back_substitution` processed the rows from bottom to top and, for each one, reduced every row above it one at a time, with a Python loop: about $n^2/2$ Python operations. Now it uses the same ideas as `lu_factor`:
+# 
+# - Only the constant terms need to be reduced to get the solution, since the coefficients above the pivots are never used again.
+# - When a row is solved, all the rows above it are reduced at once: their constant terms minus the product of the column above the pivot and the solved row (`np.outer`).
+# - The rows are solved in blocks of `block_size`. Inside a block, each row only reduces the rows of the block. When the block is solved, every row above it is reduced with a single **matrix product**.
+# 
+# It also accepts augmented matrices with $k$ columns of constant terms, of size $n \times (n+k)$, solving $k$ systems with the same coefficients at once, which makes the matrix products even more efficient. Let's compare it with `scipy.linalg.solve_triangular`, which calls the optimized [BLAS](https://en.wikipedia.org/wiki/Basic_Linear_Algebra_Subprograms) routine for triangular systems:
+
+# In[ ]:
+
+
+import scipy.linalg
+
+num_rows = 2000
+rng = np.random.default_rng(5)
+# A matrix in row echelon form with unitary pivots, well conditioned
+U = np.triu(rng.normal(size = (num_rows, num_rows)) / num_rows, 1) + np.eye(num_rows)
+
+for k in [1, 100]:
+    B = rng.normal(size = (num_rows, k))
+    M = augmented_matrix(U, B)
+
+    start = time.perf_counter()
+    solution = back_substitution(M, overwrite = True)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = scipy.linalg.solve_triangular(U, B, unit_diagonal = True)
+    elapsed_reference = time.perf_counter() - start
+
+    print(f"k = {k:>3}: back_substitution {elapsed:.3f} seconds, solve_triangular {elapsed_reference:.3f} seconds, "
+          f"largest difference {np.abs(solution.reshape(num_rows, k) - reference).max():.2e}")
+
+
+# <a name="8.10"></a>
+# ### 8.10 - Testing the functions of this section
+# 
+# The graded functions are tested by `w2_unittest`. The cell below tests the functions of this section in the same way, on small systems whose solutions are known, for example comparing the blocked `back_substitution` with `scipy.linalg.solve_triangular`. Run it after changing any of these functions.
+
+# In[ ]:
+
+
+import scipy.linalg
+
+def test_solve_linear_system():
+    B = np.ones((3, 1))
+    A = np.array([[2, 3, 5], [-3, -2, 4], [1, 1, -2]])
+    result = solve_linear_system(A, np.array([[12], [-2], [8]]))
+    assert result['status'] == 'unique' and result['rank'] == 3
+    assert np.allclose(A @ result['solution'], [12, -2, 8])
+    assert 1 <= result['condition_estimate'] < np.inf
+    # A relative tolerance: small and large matrices that are not singular
+    assert np.allclose(solve_linear_system(1e-8 * np.eye(3), B)['solution'], 1e8)
+    assert np.allclose(solve_linear_system(1e12 * np.eye(3), B)['solution'], 1e-12)
+    assert solve_linear_system(np.ones((3, 3)), B)['status'] == 'infinite'
+    assert solve_linear_system(np.ones((3, 3)), np.array([[1], [2], [3]]))['status'] == 'no solution'
+    # Rectangular systems
+    assert solve_linear_system(np.ones((2, 3)), np.ones((2, 1)))['rank'] == 1
+    assert solve_linear_system(np.array([[1, 0], [0, 1], [1, 1]]), np.array([[1], [2], [3]]))['status'] == 'unique'
+
+def test_singular_systems():
+    # The graded functions keep the fixed tolerance of np.isclose, the same with or without partial pivoting
+    B = np.ones((3, 1))
+    for partial_pivoting in [False, True]:
+        assert row_echelon_form(np.ones((3, 3)), B, partial_pivoting = partial_pivoting) == 'Singular system'
+        assert row_echelon_form(1e-8 * np.eye(3), B, partial_pivoting = partial_pivoting) == 'Singular system'
+        assert not isinstance(row_echelon_form(1e-7 * np.eye(3), B, partial_pivoting = partial_pivoting), str)
+    assert gaussian_elimination(np.ones((3, 3)), B) == 'Singular system'
+    assert np.allclose(gaussian_elimination(1e-3 * np.eye(100), np.ones((100, 1))), 1000)
+
+def test_batched_gaussian_elimination():
+    # Every tenth system is singular up to rounding: its last row is the sum of the first two
+    for seed in range(3):
+        rng = np.random.default_rng(seed)
+        A = rng.normal(size = (1000, 4, 4))
+        B = rng.normal(size = (1000, 4))
+        A[::10, 3] = A[::10, 0] + A[::10, 1]
+        X, singular = batched_gaussian_elimination(A, B)
+        assert np.array_equal(np.flatnonzero(singular), np.arange(0, 1000, 10))
+        assert np.all(np.isnan(X[singular]))
+        assert np.allclose(X[~singular], np.linalg.solve(A[~singular], B[~singular, :, np.newaxis])[:, :, 0])
+    # Several vectors of constants per system
+    B = rng.normal(size = (1000, 4, 2))
+    X, singular = batched_gaussian_elimination(A, B)
+    assert X.shape == (1000, 4, 2)
+    assert np.allclose(X[~singular], np.linalg.solve(A[~singular], B[~singular]))
+
+def test_parse_equations():
+    variables, A, B = parse_equations(["2*x\t-  y = 1", "", "x + 2*x - 1.5e1*z_1 = -3", "-y=0.5"])
+    assert variables == ['x', 'y', 'z_1']
+    assert np.array_equal(A.toarray(), [[2, -1, 0], [3, 0, -15], [0, -1, 0]])
+    assert np.array_equal(B[:, 0], [1, -3, 0.5])
+    # The matrices are regular arrays, which can be modified
+    B[0] = 2
+    assert B.flags.writeable and A.data.flags.writeable
+    # Leading-dot decimals and signed right sides
+    variables, A, B = parse_equations([".5*x + 2.*y = -.25", "x - 1e-1 * y = + 3"])
+    assert np.array_equal(A.toarray(), [[0.5, 2], [1, -0.1]])
+    assert np.array_equal(B[:, 0], [-0.25, 3])
+    # Each invalid line raises a ValueError with its line number
+    for lines, message in [(["x = 1", "3*x*y = 1"], "Line 2 has an invalid term"),
+                           (["3x6y = 1"], "Line 1 has an invalid term"),
+                           (["x y = 1"], "Line 1 has an invalid term"),
+                           (["x + y = z"], "Line 1 has an invalid right side"),
+                           (["x = "], "Line 1 has an invalid right side"),
+                           (["x = nan"], "Line 1 has an invalid right side"),
+                           (["x = -inf"], "Line 1 has an invalid right side"),
+                           (["x = 1_0"], "Line 1 has an invalid right side"),
+                           (["x = --1"], "Line 1 has an invalid right side"),
+                           (["x - -y = 1"], "Line 1 has an invalid term"),
+                           (["1_0*x = 1"], "Line 1 has an invalid term"),
+                           (["x = 1", "", "= 3"], "Line 3 has no terms"),
+                           (["x + y"], "Line 1 is not an equation")]:
+        try:
+            parse_equations(lines)
+        except ValueError as error:
+            assert str(error).startswith(message), error
+        else:
+            raise AssertionError(f"{lines} should raise a ValueError")
+
+def test_mixed_precision_gaussian_elimination():
+    # A column of zero constant terms must not give 0/0 in the backward error
+    A = np.random.default_rng(5).normal(size = (50, 50))
+    B = np.ones((50, 2))
+    B[:, 1] = 0
+    with np.errstate(all = 'raise'):
+        assert backward_error(A, np.zeros((50, 1)), np.zeros((50, 1))) == 0
+        assert backward_error(np.zeros((50, 50)), np.zeros((50, 1)), np.zeros((50, 1))) == 0
+        assert backward_error(A, np.zeros((50, 2)), B) == 1
+        result = mixed_precision_gaussian_elimination(A, B)
+    assert result['precision'] == 'mixed' and result['refinement_steps'] > 0
+    assert np.all(result['solution'][:, 1] == 0)
+    assert np.allclose(A @ result['solution'], B)
+    # Constant terms too large for float32 are scaled, and the solution is still accurate
+    with np.errstate(all = 'raise'):
+        result = mixed_precision_gaussian_elimination(A, np.ones((50, 1)) * 1e39)
+    assert result['precision'] == 'mixed' and np.all(np.isfinite(result['solution']))
+    assert np.allclose(A @ result['solution'] / 1e39, 1)
+    assert backward_error(A, np.full((50, 1), np.inf), np.ones((50, 1))) == np.inf
+    # Coefficients too large for float32 fall back to float64
+    result = mixed_precision_gaussian_elimination(A * 1e39, np.ones((50, 1)))
+    assert result['precision'] == 'float64' and np.allclose(A @ result['solution'] * 1e39, 1)
+
+def test_lu_gaussian_elimination():
+    rng = np.random.default_rng(7)
+    A = rng.normal(size = (20, 20))
+    for shape in [(20,), (20, 1), (20, 3)]:
+        B = rng.normal(size = shape)
+        solution = lu_gaussian_elimination(A, B, block_size = 8)
+        assert solution.shape == ((20,) if len(shape) == 1 or shape[1] == 1 else shape)
+        assert np.allclose(A @ solution.reshape(20, -1), B.reshape(20, -1))
+    assert lu_gaussian_elimination(np.ones((3, 3)), np.ones((3, 2))) == 'Singular system'
+
+def test_blocked_back_substitution():
+    # Block sizes that do and don't divide the number of rows
+    rng = np.random.default_rng(6)
+    U = np.triu(rng.normal(size = (37, 37)) / 37, 1) + np.eye(37)
+    for k in [1, 3]:
+        B = rng.normal(size = (37, k))
+        reference = scipy.linalg.solve_triangular(U, B, unit_diagonal = True)
+        for block_size in [1, 4, 37, 64]:
+            M = augmented_matrix(U, B)
+            solution = back_substitution(M, block_size = block_size)
+            assert solution.shape == ((37,) if k == 1 else (37, k))
+            assert np.allclose(solution.reshape(37, k), reference)
+            # Without overwrite, M is not modified
+            assert np.array_equal(M, augmented_matrix(U, B))
+
+test_solve_linear_system()
+test_singular_systems()
+test_batched_gaussian_elimination()
+test_parse_equations()
+test_mixed_precision_gaussian_elimination()
+test_lu_gaussian_elimination()
+test_blocked_back_substitution()
+print("\033[92m All tests passed")
+
+
 # Congratulations! You have finished the first assignment of this course! You built from scratch a linear system solver!
@@ -24,6 +24,12 @@
 #   - [ 2.5 Analyzing the dimensionality reduction in 2 dimensions](#2.5)
 #   - [ 2.6 Reconstructing the images from the eigenvectors](#2.6)
 #   - [ 2.7 Explained variance](#2.7)
+# - [ 3 - Going further (Section NOT graded)](#3)
+#   - [ 3.1 Randomized PCA](#3.1)
+#   - [ 3.2 PCA with fewer images than pixels](#3.2)
+#   - [ 3.3 Incremental PCA for datasets that don't fit in memory](#3.3)
+#   - [ 3.4 Loading the images faster](#3.4)
+#   - [ 3.5 Testing the functions of this section](#3.5)
 
 # ## Packages
 # 
@@ -681,7 +687,531 @@ ax[3,1].set_title('Reconstructed', size=20)
 # Now that you understand how the explained variance works you can play around with different amount of explained variance and see how this affects the reconstructed images. You can also explore how the reconstruction for different images looks. 
 # 
 # As you can see, PCA is a really useful tool for dimensionality reduction. In this assignment you saw how it works on images, but you can apply the same principle to any tabular dataset. 
+
+# <a name='3'></a>
+# ## 3 - Going further (Section NOT graded)
+# 
+# The following sections are not graded. They show how PCA can be computed for much larger datasets, using what you learned in this assignment.
+# 
+# <a name='3.1'></a>
+# ### 3.1 Randomized PCA
+# 
+# To find the principal components you computed the covariance matrix, of size $4096 \times 4096$, and its eigenvectors. Building it takes $4096 \cdot 4096 \cdot 55$ multiplications and $128$ MB of memory, and both grow with the square of the number of pixels: for images of $256 \times 256$ pixels the covariance matrix would take $34$ GB! However, you only used the first few eigenvectors.
+# 
+# A **randomized** algorithm can find them working directly with the centered data $X$, without the covariance matrix:
+# 
+# 1. Multiply $X$ by a random matrix $\Omega$ with $k + 10$ columns. Each column of $Y = X\Omega$ is a random combination of the columns of $X$, and these combinations point mostly in the directions where the data varies the most, the first principal components. The $10$ extra columns make it very unlikely to miss any of them.
+# 2. Repeat a few times $Y \leftarrow X X^T Y$ (the **power iterations**). Each repetition multiplies each direction by its eigenvalue, so the directions with large eigenvalues dominate even more.
+# 3. Find an orthonormal basis $Q$ of the columns of $Y$ with the QR decomposition (`np.linalg.qr`). It is repeated after each power iteration so the small directions are not lost to rounding errors.
+# 4. Project the data onto this basis, $B = Q^T X$, a small matrix with $k + 10$ rows, and compute its singular value decomposition with `np.linalg.svd`. The right singular vectors of $B$ are the principal components, and the squares of the singular values divided by $n - 1$ are the eigenvalues of the covariance matrix.
+# 
+# The total variance, needed for the explained variance, is the sum of the diagonal of the covariance matrix, which is the sum of the squares of all the values in $X$ divided by $n - 1$. It can also be computed without the covariance matrix.
+# 
+# The function `randomized_PCA` returns the eigenvalues and eigenvectors in decreasing order, so `eigenvecs` can be used in `perform_PCA` and `reconstruct_image` as before.
+
+# In[ ]:
+
+
+def randomized_PCA(X, k, n_oversamples=10, n_power_iterations=4, seed=7):
+    """
+    Compute the first k principal components of the centered data with a randomized SVD, without the covariance matrix
+    Args:
+        X (ndarray): centered data matrix. Shape (n_observations x n_pixels)
+        k (int): number of principal components to compute
+        n_oversamples (int): number of extra random directions used to find the components
+        n_power_iterations (int): number of power iterations, more iterations give more accurate components
+        seed (int): seed for the random directions
+    Outputs:
+        eigenvals (ndarray): the k largest eigenvalues of the covariance matrix, in decreasing order
+        eigenvecs (ndarray): the corresponding eigenvectors. Shape (n_pixels x k)
+        explained_variance (ndarray): the explained variance of each of the k components
+    """
+    n_observations = X.shape[0]
+    n_directions = min(k + n_oversamples, min(X.shape))
+
+    rng = np.random.default_rng(seed)
+    omega = rng.standard_normal((X.shape[1], n_directions))
+
+    # Orthonormal basis for the random combinations of the columns of X
+    Q, _ = np.linalg.qr(np.dot(X, omega))
+    for _ in range(n_power_iterations):
+        Q, _ = np.linalg.qr(np.dot(X.T, Q))
+        Q, _ = np.linalg.qr(np.dot(X, Q))
+
+    # SVD of the data projected onto the basis, a small matrix
+    B = np.dot(Q.T, X)
+    _, singular_values, Vt = np.linalg.svd(B, full_matrices=False)
+
+    eigenvals = singular_values[:k]**2/(n_observations-1)
+    eigenvecs = Vt[:k].T
+
+    # The total variance is the trace of the covariance matrix
+    total_variance = np.sum(X**2)/(n_observations-1)
+    explained_variance = eigenvals/total_variance
+
+    return eigenvals, eigenvecs, explained_variance
+
+
+# Compare the results with the eigenvalues and eigenvectors you computed with `scipy.sparse.linalg.eigsh`. Remember that each eigenvector can point in two opposite directions, so compare them using the absolute value of their dot product: it is $1$ when they are on the same line.
+
+# In[ ]:
+
+
+import time
+
+start = time.perf_counter()
+rand_eigenvals, rand_eigenvecs, rand_explained_variance = randomized_PCA(X, 35)
+print(f'randomized_PCA took {time.perf_counter() - start:.3f} seconds')
+
+start = time.perf_counter()
+eigsh_eigenvals, eigsh_eigenvecs = scipy.sparse.linalg.eigsh(get_cov_matrix(X), k=35)
+print(f'get_cov_matrix and eigsh took {time.perf_counter() - start:.3f} seconds')
+
+# eigsh returns the eigenvalues in increasing order, sort them in decreasing order as randomized_PCA does
+order = np.argsort(eigsh_eigenvals)[::-1]
+eigsh_eigenvals, eigsh_eigenvecs = eigsh_eigenvals[order], eigsh_eigenvecs[:,order]
+
+print(f'Largest difference between the eigenvalues: {np.max(np.abs(rand_eigenvals - eigsh_eigenvals)/eigsh_eigenvals):.2e} (relative)')
+alignment = np.abs(np.sum(rand_eigenvecs*eigsh_eigenvecs, axis=0))
+print(f'Alignment of the first 10 eigenvectors: {np.round(alignment[:10], 4)}')
+print(f'Explained variance of the 35 components: {np.sum(rand_explained_variance):.4f}')
+
+Xrec35_randomized = reconstruct_image(perform_PCA(X, rand_eigenvecs, 35), rand_eigenvecs)
+fig, ax = plt.subplots(1,2, figsize=(10,5))
+ax[0].imshow(Xrec35[0].reshape(height, width), cmap='gray')
+ax[0].set_title('Reconstructed with eigsh')
+ax[1].imshow(Xrec35_randomized[0].reshape(height, width), cmap='gray')
+ax[1].set_title('Reconstructed with randomized_PCA')
+
+
+# <a name='3.2'></a>
+# ### 3.2 PCA with fewer images than pixels
+# 
+# Remember that at most 55 eigenvalues of the $4096 \times 4096$ covariance matrix are different from zero, one for each image. There is a way to find them using a matrix of size $55 \times 55$ instead, the **Gram matrix** $G = \frac{1}{n-1} X X^T$, whose entries are the dot products between pairs of images.
+# 
+# If $u$ is an eigenvector of $G$ with eigenvalue $\lambda$, then $\frac{1}{n-1} X X^T u = \lambda u$. Multiplying both sides by $X^T$:
 # 
+# $$\frac{1}{n-1} X^T X \left(X^T u\right) = \lambda \left(X^T u\right),$$
+# 
+# so $X^T u$ is an eigenvector of the covariance matrix $\frac{1}{n-1} X^T X$ with the **same eigenvalue** $\lambda$. Its norm is $\sqrt{u^T X X^T u} = \sqrt{(n-1)\lambda}$, so the principal component with norm 1 is
+# 
+# $$v = \frac{X^T u}{\sqrt{(n-1)\lambda}}.$$
+# 
+# Building $G$ takes $55 \cdot 55 \cdot 4096$ multiplications instead of $4096 \cdot 4096 \cdot 55$, about $75$ times less, and it takes $24$ kB of memory instead of $128$ MB. This is sometimes called the **snapshot** method.
+# 
+# The function `compute_PCA` below chooses automatically: it uses the Gram matrix when there are fewer observations than variables, and the covariance matrix otherwise. Since `X` is centered, its rows add up to zero, so at most $n-1$ eigenvalues are different from zero. The eigenvalues that are zero up to rounding errors are dropped, since their eigenvectors can't be recovered with the formula above.
+
+# In[ ]:
+
+
+def compute_PCA(X, k=None, method='auto'):
+    """
+    Compute the principal components of the centered data using the covariance or the Gram matrix
+    Args:
+        X (ndarray): centered data matrix. Shape (n_observations x n_pixels)
+        k (int): number of principal components to compute. If None, all the components with non-zero eigenvalue
+        method (str): 'gram', 'covariance' or 'auto', which uses the Gram matrix when n_observations < n_pixels
+    Outputs:
+        eigenvals (ndarray): the k largest eigenvalues of the covariance matrix, in decreasing order
+        eigenvecs (ndarray): the corresponding eigenvectors. Shape (n_pixels x k)
+    """
+    n_observations, n_pixels = X.shape
+    if method == 'auto':
+        method = 'gram' if n_observations < n_pixels else 'covariance'
+
+    if method == 'gram':
+        gram_matrix = np.dot(X, X.T)/(n_observations-1)
+        # np.linalg.eigh is the version of np.linalg.eig for symmetric matrices, eigenvalues are in increasing order
+        eigenvals, eigenvecs = np.linalg.eigh(gram_matrix)
+    elif method == 'covariance':
+        eigenvals, eigenvecs = np.linalg.eigh(get_cov_matrix(X))
+    else:
+        raise ValueError(f"Unknown method '{method}'")
+
+    eigenvals = eigenvals[::-1]
+    eigenvecs = eigenvecs[:,::-1]
+
+    # Drop the eigenvalues that are zero up to rounding errors
+    n_nonzero = np.sum(eigenvals > eigenvals[0]*max(X.shape)*np.finfo(eigenvals.dtype).eps)
+    k = n_nonzero if k is None else min(k, n_nonzero)
+    eigenvals = eigenvals[:k]
+    eigenvecs = eigenvecs[:,:k]
+
+    if method == 'gram':
+        # Map the eigenvectors of the Gram matrix to eigenvectors of the covariance matrix, with norm 1
+        eigenvecs = np.dot(X.T, eigenvecs)/np.sqrt((n_observations-1)*eigenvals)
+
+    return eigenvals, eigenvecs
+
+
+# In[ ]:
+
+
+start = time.perf_counter()
+gram_eigenvals, gram_eigenvecs = compute_PCA(X)
+print(f'compute_PCA with the Gram matrix took {time.perf_counter() - start:.3f} seconds and found {len(gram_eigenvals)} components')
+
+k = len(gram_eigenvals)
+print(f'Largest difference between the eigenvalues: {np.max(np.abs(gram_eigenvals - eigenvals[:k])/eigenvals[:k]):.2e} (relative)')
+alignment = np.abs(np.sum(gram_eigenvecs*eigenvecs[:,:k], axis=0))
+print(f'Alignment of the first 10 eigenvectors: {np.round(alignment[:10], 4)}')
+
+
+# <a name='3.3'></a>
+# ### 3.3 Incremental PCA for datasets that don't fit in memory
+# 
+# To center the data, `center_data` needs all the images at once in `imgs_flatten`. With millions of images, they don't fit in memory. **Incremental PCA** reads the images in small batches and updates the principal components after each batch, keeping only:
+# 
+# - the number of images seen so far, $m$, and their mean $\mu$,
+# - the first $k$ principal components $V_k$ (as rows) and their **singular values** $s_1, \ldots, s_k$. The singular values of the centered data are related to the eigenvalues of the covariance matrix by $\lambda_i = \frac{s_i^2}{m-1}$.
+# 
+# Multiplying each component by its singular value, $\mathrm{diag}(s) V_k$ is a small matrix with $k$ rows that "summarizes" all the images seen so far: it has the same principal components and eigenvalues. When a new batch $Y_b$ with $b$ images and mean $\mu_b$ arrives, the components of all the images are the ones of the matrix
+# 
+# $$\begin{bmatrix} \mathrm{diag}(s) V_k \\ Y_b - \mu_b \\ \sqrt{\frac{m b}{m + b}} \left(\mu - \mu_b\right) \end{bmatrix},$$
+# 
+# which has only $k + b + 1$ rows. The last row accounts for the fact that the old images and the new batch were centered with different means. The new components and singular values are given by its singular value decomposition (`np.linalg.svd`), keeping the first $k$. This is the algorithm of [Ross et al. (2008)](https://www.cs.toronto.edu/~dross/ivt/RossLimLinYang_ijcv.pdf).
+# 
+# If $k$ is at least the number of non-zero eigenvalues, no information is lost and the result is the same as with all the images at once. Otherwise, it is an approximation, usually very good for the first components. The memory used depends only on the batch size and on $k$, not on the number of images.
+# 
+# The function `load_image_batches` reads the images of a directory in batches, in grayscale, one batch at a time, and `incremental_PCA` updates the components with each batch. Only the files with an image extension are read, so other files in the directory, like the `.DS_Store` files created by macOS, are ignored.
+
+# In[ ]:
+
+
+import os
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+def list_image_files(directory):
+    """
+    List the image files of a directory, in alphabetical order
+    Args:
+        directory (str): path of the directory with the images
+    Outputs:
+        filenames (list): names of the files with an image extension. Other files and subdirectories are ignored
+    """
+    return sorted(filename for filename in os.listdir(directory)
+                  if filename.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(directory, filename)))
+
+def load_image_batches(directory, batch_size=10):
+    """
+    Read the images of a directory in batches, in grayscale
+    Args:
+        directory (str): path of the directory with the images
+        batch_size (int): number of images in each batch
+    Outputs:
+        Yields arrays of shape (batch_size x n_pixels) with the flattened images, the last one may be smaller
+    """
+    filenames = list_image_files(directory)
+    if not filenames:
+        raise ValueError(f'No image files were found in {directory}')
+    for start in range(0, len(filenames), batch_size):
+        batch = []
+        for filename in filenames[start:start+batch_size]:
+            # Close each file as soon as it is decoded
+            with Image.open(os.path.join(directory, filename)) as image:
+                batch.append(np.asarray(image.convert('L'), dtype=float).reshape(-1))
+        yield np.array(batch)
+
+def incremental_PCA(batches, k):
+    """
+    Compute the first k principal components updating them with each batch of data
+    Args:
+        batches (iterable): batches of flattened images, arrays of shape (batch_size x n_pixels). They don't need to be centered
+        k (int): number of principal components to keep
+    Outputs:
+        mean_vector (ndarray): the mean of all the images
+        eigenvals (ndarray): the k largest eigenvalues of the covariance matrix, in decreasing order
+        eigenvecs (ndarray): the corresponding eigenvectors. Shape (n_pixels x k)
+    """
+    n_seen = 0
+    for batch in batches:
+        n_batch = batch.shape[0]
+        batch_mean = np.mean(batch, axis=0)
+
+        if n_seen == 0:
+            M = batch - batch_mean
+        else:
+            n_total = n_seen + n_batch
+            mean_correction = np.sqrt(n_seen*n_batch/n_total)*(mean_vector - batch_mean)
+            M = np.vstack((singular_values[:,np.newaxis]*components, batch - batch_mean, mean_correction))
+            batch_mean = (n_seen*mean_vector + n_batch*batch_mean)/n_total
+
+        _, S, Vt = np.linalg.svd(M, full_matrices=False)
+        components = Vt[:k]
+        singular_values = S[:k]
+        mean_vector = batch_mean
+        n_seen += n_batch
+
+    if n_seen == 0:
+        raise ValueError('No images were found in the batches, check that the directory they are read from has image files')
+    eigenvals = singular_values**2/(n_seen-1)
+    eigenvecs = components.T
+
+    return mean_vector, eigenvals, eigenvecs
+
+
+# Let's read the cat images in batches of 10 and compare the result with the components you computed before. Notice that the images need to be centered with the mean found by `incremental_PCA` before using `perform_PCA`.
+
+# In[ ]:
+
+
+mean_vector, inc_eigenvals, inc_eigenvecs = incremental_PCA(load_image_batches('./data/', batch_size=10), k=55)
+
+print(f'Largest difference between the 35 largest eigenvalues: {np.max(np.abs(inc_eigenvals[:35] - eigenvals[:35])/eigenvals[:35]):.2e} (relative)')
+alignment = np.abs(np.sum(inc_eigenvecs[:,:35]*eigenvecs[:,:35], axis=0))
+print(f'Alignment of the first 10 eigenvectors: {np.round(alignment[:10], 4)}')
+
+# Reduce and reconstruct the first image, centering it with the mean found by incremental_PCA
+first_image = next(load_image_batches('./data/', batch_size=1))
+Xrec35_incremental = reconstruct_image(perform_PCA(first_image - mean_vector, inc_eigenvecs, 35), inc_eigenvecs) + mean_vector
+plt.imshow(Xrec35_incremental[0].reshape(height, width), cmap='gray')
+
+
+# <a name='3.4'></a>
+# ### 3.4 Loading the images faster
+# 
+# Every time you run this notebook, each image file is opened and decoded again, which is most of the time spent loading the data. Instead, the images can be decoded **once** and saved in a single `.npy` file, one image after another, together with a small index file with their shape, type and file names.
+# 
+# The next times, the file is opened with `np.load(..., mmap_mode='r')`, which creates a **memory-mapped** array: nothing is read when it is opened, and the operating system reads the parts of the file that are used, when they are used. Opening it takes milliseconds, no matter how many images there are. And since the images are stored one after another, flattening them with `reshape` is just a different view of the same memory, without any copy. If several programs open the same file, the operating system keeps a single copy of it in memory for all of them.
+# 
+# `load_images_cached` creates the store the first time, and creates it again if the images in the directory change. To detect the changes, the index keeps the name, the size and the modification time of each image file: if any of them is different, or a file was added or removed, the store is rebuilt.
+# 
+# Another program may be using the store while it is rebuilt. Writing over a file that is mapped in memory could give that program half-written images, or even crash it. So the new files are written with temporary names in the same directory, and then renamed to `images.npy` and `index.json` with `os.replace`. The rename is **atomic**: the other programs see either the old file or the new one, never a mix, and the ones that already mapped the old file keep reading it.
+# 
+# The cell below creates the store in `./data_store/`, which is listed in the `.gitignore` file of this repository, so it is not committed by mistake. Note that the rest of this notebook still uses `imgs_flatten`, the copy of the images loaded in memory at the beginning: the store is only shown here. To use it in your own code, replace `imgs_flatten` with `store_imgs_flatten`, keeping in mind that its pixels are stored as `uint8` and that it is read-only. `center_data` works with it, since it returns a new array of floats.
+
+# In[ ]:
+
+
+import json
+import tempfile
+
+def describe_image_files(directory, filenames):
+    """
+    Describe the image files of a directory, to detect when they change
+    Args:
+        directory (str): path of the directory with the images
+        filenames (list): names of the image files
+    Outputs:
+        files (list): a list [name, size in bytes, modification time in nanoseconds] for each file
+    """
+    files = []
+    for filename in filenames:
+        stat = os.stat(os.path.join(directory, filename))
+        files.append([filename, stat.st_size, stat.st_mtime_ns])
+    return files
+
+def build_image_store(directory, store_directory, dtype='uint8'):
+    """
+    Decode the images of a directory once and save them in a single .npy file with an index
+    Args:
+        directory (str): path of the directory with the images
+        store_directory (str): path of the directory where images.npy and index.json are saved
+        dtype (str): type of the stored pixels, 'uint8' (1 byte per pixel) or 'float32'
+    Outputs:
+        index (dict): the shape and type of the stored images, and the name, size and modification time of each file
+    """
+    filenames = list_image_files(directory)
+    if not filenames:
+        raise ValueError(f'No image files were found in {directory}')
+    paths = [os.path.join(directory, filename) for filename in filenames]
+    # Describe the files before decoding them, so a file changed meanwhile is detected the next time
+    files = describe_image_files(directory, filenames)
+    with Image.open(paths[0]) as image:
+        width, height = image.size
+
+    os.makedirs(store_directory, exist_ok=True)
+    # Write both files with temporary names in the store directory, so they can be renamed atomically
+    images_fd, images_path = tempfile.mkstemp(dir=store_directory, prefix='images.', suffix='.tmp')
+    os.close(images_fd)
+    index_path = None
+    try:
+        # open_memmap creates the .npy file and maps it in memory, so the images are written directly to the file
+        images = np.lib.format.open_memmap(images_path, mode='w+', dtype=dtype, shape=(len(paths), height, width))
+        for i, path in enumerate(paths):
+            with Image.open(path) as image:
+                images[i] = np.asarray(image.convert('L'))
+        images.flush()
+        shape = list(images.shape)
+        del images
+
+        index = {'shape': shape, 'dtype': dtype, 'files': files}
+        index_fd, index_path = tempfile.mkstemp(dir=store_directory, prefix='index.', suffix='.tmp')
+        with os.fdopen(index_fd, 'w') as f:
+            json.dump(index, f)
+
+        # The images first: an index is never renamed before the images it describes
+        os.replace(images_path, os.path.join(store_directory, 'images.npy'))
+        os.replace(index_path, os.path.join(store_directory, 'index.json'))
+    except BaseException:
+        for path in (images_path, index_path):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        raise
+    return index
+
+def load_image_store(store_directory):
+    """
+    Open the images saved by build_image_store, without reading them
+    Args:
+        store_directory (str): path of the directory with images.npy and index.json
+    Outputs:
+        images (np.memmap): read-only array of shape (n_images x height x width) mapped to the file
+        index (dict): the shape and type of the stored images, and the name, size and modification time of each file
+    """
+    with open(os.path.join(store_directory, 'index.json')) as f:
+        index = json.load(f)
+    images = np.load(os.path.join(store_directory, 'images.npy'), mmap_mode='r')
+    if list(images.shape) != index['shape'] or images.dtype != index['dtype']:
+        raise ValueError(f'The images in {store_directory} do not match their index')
+    return images, index
+
+def load_images_cached(directory, store_directory, dtype='uint8'):
+    """
+    Load the images of a directory from their store, building it if it doesn't exist or the images changed
+    Args:
+        directory (str): path of the directory with the images
+        store_directory (str): path of the directory with the store
+        dtype (str): type of the stored pixels, 'uint8' or 'float32'
+    Outputs:
+        images (np.memmap): read-only array of shape (n_images x height x width) mapped to the file
+    """
+    filenames = list_image_files(directory)
+    try:
+        images, index = load_image_store(store_directory)
+        # Any added, removed or replaced file changes the list, even if its modification time is older
+        is_current = index['files'] == describe_image_files(directory, filenames) and index['dtype'] == dtype
+    except (OSError, ValueError, KeyError):
+        is_current = False
+
+    if not is_current:
+        # Release the old mapping, on Windows a mapped file can't be replaced
+        images = None
+        build_image_store(directory, store_directory, dtype)
+        images, _ = load_image_store(store_directory)
+    return images
+
+
+# In[ ]:
+
+
+start = time.perf_counter()
+images = load_images_cached('./data/', './data_store/')
+print(f'First run (builds the store): {time.perf_counter() - start:.3f} seconds')
+
+start = time.perf_counter()
+images = load_images_cached('./data/', './data_store/')
+print(f'Next runs (maps the store):   {time.perf_counter() - start:.3f} seconds')
+
+# Flattening is a view of the mapped file, no pixel is copied
+store_imgs_flatten = images.reshape(len(images), -1)
+print(f'store_imgs_flatten shape: {store_imgs_flatten.shape}, shares memory with the store: {np.shares_memory(store_imgs_flatten, images)}')
+
+
+# <a name='3.5'></a>
+# ### 3.5 Testing the functions of this section
+# 
+# The exercises are tested by `w4_unittest`. The cell below tests the functions of this section in the same way, on small random images saved in temporary directories, which are removed at the end. For example, `incremental_PCA` must find the same components as `compute_PCA` with all the images at once. Run it after changing any of these functions.
+
+# In[ ]:
+
+
+def save_random_images(directory, n_images, height, width, seed):
+    """
+    Save random grayscale images in a directory, with a file that is not an image and a subdirectory
+    """
+    rng = np.random.default_rng(seed)
+    images = rng.integers(0, 256, size=(n_images, height, width), dtype=np.uint8)
+    for i, image in enumerate(images):
+        Image.fromarray(image).save(os.path.join(directory, f'image_{i:02d}.png'))
+    with open(os.path.join(directory, '.DS_Store'), 'wb') as f:
+        f.write(b'not an image')
+    os.makedirs(os.path.join(directory, 'subdirectory.png'))
+    return images
+
+def test_compute_PCA():
+    # The Gram and covariance methods find the same components
+    rng = np.random.default_rng(0)
+    X_test = rng.standard_normal((8, 30))*np.linspace(3, 0.1, 30)
+    X_test = X_test - np.mean(X_test, axis=0)
+    gram_eigenvals, gram_eigenvecs = compute_PCA(X_test, method='gram')
+    cov_eigenvals, cov_eigenvecs = compute_PCA(X_test, method='covariance')
+    # 8 centered observations have 7 non-zero eigenvalues
+    assert len(gram_eigenvals) == len(cov_eigenvals) == 7
+    assert np.allclose(gram_eigenvals, cov_eigenvals)
+    assert np.all(np.diff(gram_eigenvals) <= 0)
+    assert np.allclose(np.abs(np.sum(gram_eigenvecs*cov_eigenvecs, axis=0)), 1)
+    assert np.allclose(np.dot(gram_eigenvecs.T, gram_eigenvecs), np.eye(7))
+    assert np.allclose(compute_PCA(X_test, k=3)[0], gram_eigenvals[:3])
+    try:
+        compute_PCA(X_test, method='svd')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('An unknown method should raise a ValueError')
+
+def test_incremental_PCA():
+    with tempfile.TemporaryDirectory() as directory:
+        images = save_random_images(directory, 13, 6, 5, seed=1)
+        batches = list(load_image_batches(directory, batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 4, 1]
+    images_flatten = images.reshape(13, -1).astype(float)
+    assert np.array_equal(np.vstack(batches), images_flatten)
+
+    # With k at least the number of non-zero eigenvalues, the result is the same as with all the images at once
+    mean_vector, inc_eigenvals, inc_eigenvecs = incremental_PCA(iter(batches), k=12)
+    eigenvals, eigenvecs = compute_PCA(images_flatten - np.mean(images_flatten, axis=0), method='covariance')
+    assert np.allclose(mean_vector, np.mean(images_flatten, axis=0))
+    assert np.allclose(inc_eigenvals, eigenvals)
+    assert np.allclose(np.abs(np.sum(inc_eigenvecs*eigenvecs, axis=0)), 1)
+
+    # An empty directory or no batches raise a ValueError that says so
+    with tempfile.TemporaryDirectory() as directory:
+        for batches, message in [(load_image_batches(directory), 'No image files were found in'), ([], 'No images were found')]:
+            try:
+                incremental_PCA(batches, k=3)
+            except ValueError as error:
+                assert str(error).startswith(message), error
+            else:
+                raise AssertionError('incremental_PCA without images should raise a ValueError')
+
+def test_load_images_cached():
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as store_directory:
+        images = save_random_images(directory, 5, 6, 4, seed=2)
+        cached = load_images_cached(directory, store_directory)
+        assert isinstance(cached, np.memmap) and np.array_equal(cached, images)
+        assert sorted(os.listdir(store_directory)) == ['images.npy', 'index.json']
+
+        # Replace an image by a different one with an older modification time: the store must be rebuilt
+        path = os.path.join(directory, 'image_00.png')
+        modified = os.stat(path).st_mtime_ns - 10**9
+        Image.fromarray(255 - images[0]).save(path)
+        os.utime(path, ns=(modified, modified))
+        rebuilt = load_images_cached(directory, store_directory)
+        assert np.array_equal(rebuilt[0], 255 - images[0])
+        # The old mapping still reads the old images, the file was replaced and not overwritten
+        assert np.array_equal(cached, images)
+        assert sorted(os.listdir(store_directory)) == ['images.npy', 'index.json']
+        del cached, rebuilt
+
+    # An empty directory raises a ValueError and doesn't create any file
+    with tempfile.TemporaryDirectory() as directory, tempfile.TemporaryDirectory() as store_directory:
+        try:
+            load_images_cached(directory, store_directory)
+        except ValueError as error:
+            assert str(error).startswith('No image files were found in'), error
+        else:
+            raise AssertionError('A directory without images should raise a ValueError')
+        assert os.listdir(store_directory) == []
+
+test_compute_PCA()
+test_incremental_PCA()
+test_load_images_cached()
+print('\033[92m All tests passed')
+
+
 # Congratulations! You have finished the assignment in this week.
 
 # 
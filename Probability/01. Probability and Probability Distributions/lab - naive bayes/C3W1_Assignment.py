@@ -27,6 +27,17 @@
 # - [ 5 - Appendix (Section NOT graded)](#5)
 #   - [ 5.1 Hidden problem in the Naive Bayes model.](#5.1)
 #   - [ 5.2 Enhancing model performance: Practical implementation with Naive Bayes](#5.2)
+#   - [ 5.3 Scaling up: Vectorized training with sparse matrices](#5.3)
+#   - [ 5.4 Scoring a whole test set at once](#5.4)
+#   - [ 5.5 Scoring a single email with the compiled model](#5.5)
+#   - [ 5.6 Preprocessing large mailboxes in parallel](#5.6)
+#   - [ 5.7 Updating the model with new emails](#5.7)
+#   - [ 5.8 Bounding the memory with feature hashing](#5.8)
+#   - [ 5.9 Choosing the decision threshold](#5.9)
+#   - [ 5.10 Saving the model to disk](#5.10)
+#   - [ 5.11 More than two classes: a general Naive Bayes engine](#5.11)
+#   - [ 5.12 Measuring the throughput of the pipeline](#5.12)
+#   - [ 5.13 Testing the functions of the appendix](#5.13)
 # 
 
 # <a name="1"></a>
@@ -191,6 +202,9 @@ print(f"Class: {Y[email_index]}")
 # In[10]:
 
 
+# Make a set with the stopwords and punctuation. It is built only once and reused by every call to preprocess_text
+STOP_WORDS = set(stopwords.words('english') + list(string.punctuation))
+
 def preprocess_text(X):
     """
     Preprocesses a collection of text data by removing stopwords and punctuation.
@@ -207,9 +221,6 @@ def preprocess_text(X):
     - The function uses the Natural Language Toolkit (nltk) library for tokenization and stopword removal.
     - If the input is a single string, it is converted into a one-element numpy array.
     """
-    # Make a set with the stopwords and punctuation
-    stop = set(stopwords.words('english') + list(string.punctuation))
-
     # The next lines will handle the case where a single email is passed instead of an array of emails.
     if isinstance(X, str):
         X = np.array([X])
@@ -218,7 +229,7 @@ def preprocess_text(X):
     X_preprocessed = []
 
     for i, email in enumerate(X):
-        email = np.array([i.lower() for i in word_tokenize(email) if i.lower() not in stop]).astype(X.dtype)
+        email = np.array([i.lower() for i in word_tokenize(email) if i.lower() not in STOP_WORDS]).astype(X.dtype)
         X_preprocessed.append(email)
         
     if len(X) == 1:
@@ -680,10 +691,41 @@ w1_unittest.test_naive_bayes(naive_bayes, word_frequency, class_frequency)
 # - Count every ham email that the model correctly classifies as ham (these are called **true negatives**)
 # 
 # Finally, to get a proportion, you divide the sum of the true positives and true negatives by the total number of observations. If the model is perfect, then the accuracy would be 1, or 100%. The next code block will implement functions to make this calculation.
+# 
+# Every email falls in exactly one of four cases, depending on its true label and its predicted label. Encoding each email as the number $2 \cdot \text{true label} + \text{predicted label}$, the four cases become the numbers $0$ (true negative), $1$ (false positive), $2$ (false negative) and $3$ (true positive). So counting how many times each number appears, with [`np.bincount`](https://numpy.org/doc/stable/reference/generated/numpy.bincount.html), gives the four counts in a single pass over the labels. The function `confusion_counts` does exactly this, and the functions that count each case just read the value they need from it.
 
 # In[35]:
 
 
+def confusion_counts(Y_true, Y_pred):
+    """
+    Calculate the number of true negatives, false positives, false negatives and true positives in binary classification,
+    in a single pass over the labels.
+
+    Parameters:
+    - Y_true (array-like): True labels (0 or 1) for each instance.
+    - Y_pred (array-like): Predicted labels (0 or 1) for each instance. It must match Y_true in length.
+
+    Returns:
+    - tuple: A tuple with the format (true_negatives, false_positives, false_negatives, true_positives)
+
+    Raises:
+    - ValueError: If Y_true and Y_pred have different shapes or contain labels other than 0 and 1.
+    """
+    Y_true = np.asarray(Y_true)
+    Y_pred = np.asarray(Y_pred)
+    # Without these checks, a single prediction would be compared with every label (broadcasting)
+    # and other labels would be counted in the wrong bins
+    if Y_true.shape != Y_pred.shape:
+        raise ValueError(f"Y_true and Y_pred must have the same shape, got {Y_true.shape} and {Y_pred.shape}")
+    if not (np.isin(Y_true, (0, 1)).all() and np.isin(Y_pred, (0, 1)).all()):
+        raise ValueError("The labels must be 0 or 1")
+    Y_true = Y_true.astype(np.int64)
+    Y_pred = Y_pred.astype(np.int64)
+    # 0 = true negative, 1 = false positive, 2 = false negative, 3 = true positive
+    true_negatives, false_positives, false_negatives, true_positives = np.bincount(2*Y_true + Y_pred, minlength = 4)
+    return (int(true_negatives), int(false_positives), int(false_negatives), int(true_positives))
+
 def get_true_positives(Y_true, Y_pred):
     """
     Calculate the number of true positive instances in binary classification.
@@ -698,17 +740,7 @@ def get_true_positives(Y_true, Y_pred):
     # Both Y_true and Y_pred must match in length.
     if len(Y_true) != len(Y_pred):
         return "Number of true labels and predict labels must match!"
-    n = len(Y_true)
-    true_positives = 0
-    # Iterate over the number of elements in the list
-    for i in range(n):
-        # Get the true label for the considered email
-        true_label_i = Y_true[i]
-        # Get the predicted (model output) for the considered email
-        predicted_label_i = Y_pred[i]
-        # Increase the counter by 1 only if true_label_i = 1 and predicted_label_i = 1 (true positives)
-        if true_label_i == 1 and predicted_label_i == 1:
-            true_positives += 1
+    true_negatives, false_positives, false_negatives, true_positives = confusion_counts(Y_true, Y_pred)
     return true_positives
         
 def get_true_negatives(Y_true, Y_pred):
@@ -726,19 +758,8 @@ def get_true_negatives(Y_true, Y_pred):
     # Both Y_true and Y_pred must match in length.
     if len(Y_true) != len(Y_pred):
         return "Number of true labels and predict labels must match!"
-    n = len(Y_true)
-    true_negatives = 0
-    # Iterate over the number of elements in the list
-    for i in range(n):
-        # Get the true label for the considered email
-        true_label_i = Y_true[i]
-        # Get the predicted (model output) for the considered email
-        predicted_label_i = Y_pred[i]
-        # Increase the counter by 1 only if true_label_i = 0 and predicted_label_i = 0 (true negatives)
-        if true_label_i == 0 and predicted_label_i == 0:
-            true_negatives += 1
+    true_negatives, false_positives, false_negatives, true_positives = confusion_counts(Y_true, Y_pred)
     return true_negatives
-        
 
 
 # In[36]:
@@ -1093,12 +1114,16 @@ def get_recall(Y_true, Y_pred):
 
     Returns:
     - recall (float): The recall score, which is the ratio of true positives to the total number of actual positives.
+      It is nan (undefined) if there are no actual positives.
     """
-    # Get the total number of spam emails. Since they are 1 in the data, it suffices summing all the values in the array Y.
-    total_number_spams = Y_test.sum()
-    # Get the true positives
-    true_positives = get_true_positives(Y_true, Y_pred)
+    true_negatives, false_positives, false_negatives, true_positives = confusion_counts(Y_true, Y_pred)
+    # Every spam email is either a true positive or a false negative
+    total_number_spams = true_positives + false_negatives
     
+    # Without actual positives the recall is undefined
+    if total_number_spams == 0:
+        return np.nan
+
     # Compute the recall
     recall = true_positives/total_number_spams
     return recall
@@ -1155,18 +1180,7 @@ def get_false_positives(Y_true, Y_pred):
     # Both Y_true and Y_pred must match in length.
     if len(Y_true) != len(Y_pred):
         return "Number of true labels and predict labels must match!"
-    n = len(Y_true)
-
-    false_positives = 0
-    # Iterate over the number of elements in the list
-    for i in range(n):
-        # Get the true label for the considered email
-        true_label_i = Y_true[i]
-        # Get the predicted (model output) for the considered email
-        predicted_label_i = Y_pred[i]
-        # Increase the counter by 1 only if true_label_i = 0 and predicted_label_i = 0 (false positive)
-        if true_label_i == 0 and predicted_label_i == 1:
-            false_positives += 1
+    true_negatives, false_positives, false_negatives, true_positives = confusion_counts(Y_true, Y_pred)
     return false_positives
 
 
@@ -1209,11 +1223,13 @@ def get_precision(Y_true, Y_pred):
     - Y_pred (list): Predicted labels.
 
     Returns:
-    - precision (float): Precision score.
+    - precision (float): Precision score. It is nan (undefined) if no instance is predicted positive.
     """
-    # Get the true positives
-    true_positives = get_true_positives(Y_true, Y_pred)
-    false_positives = get_false_positives(Y_true, Y_pred)
+    # Get the true positives and false positives in a single pass
+    true_negatives, false_positives, false_negatives, true_positives = confusion_counts(Y_true, Y_pred)
+    # Without predicted positives there is nothing to measure, so the precision is undefined
+    if true_positives + false_positives == 0:
+        return np.nan
     precision = true_positives/(true_positives + false_positives)
     return precision
 
@@ -1229,6 +1245,1428 @@ print(f"Precision of the log Naive Bayes model: {get_precision(Y_test, Y_pred_lo
 # 
 # On the other hand, the improved model has a precision of 98.42%! So from 100 emails classified as spam, only around 2 will be actually ham emails. A much more reliable output. 
 
+# <a name="5.3"></a>
+# ### 5.3 Scaling up: Vectorized training with sparse matrices
+# 
+# The function `get_word_frequency` you wrote in Exercise 1 walks through every email and every word in a Python double loop, updating a nested dictionary one word at a time. This is perfect to understand the algorithm, but once the corpus grows to millions of emails this loop dominates the training time.
+# 
+# The same counts can be obtained with linear algebra. First, every distinct word in the training set receives an integer index, its **vocabulary id**. Then, the whole dataset is represented as a **document-term matrix** $M$, with one row per email and one column per word, where $M_{ij} = 1$ if the word $j$ appears in the email $i$ and $0$ otherwise. Since each email uses only a tiny fraction of the vocabulary, almost every entry is $0$, so $M$ is stored as a [sparse matrix](https://docs.scipy.org/doc/scipy/reference/sparse.html) in the CSR (Compressed Sparse Row) format, which only keeps the non-zero entries.
+# 
+# Finally, let $C$ be the matrix with one row per email and two columns, where the first column is $1$ for spam emails and the second is $1$ for ham emails. Then the product
+# 
+# $$M^T C$$
+# 
+# is a matrix with one row per word, whose columns are exactly the number of spam and ham emails containing that word. A single sparse matrix product replaces the whole double loop!
+
+# In[ ]:
+
+
+import itertools
+from scipy import sparse
+
+def build_document_term_matrix(X, vocabulary = None, binary = True):
+    """
+    Builds a sparse document-term matrix for a collection of treated emails.
+
+    Parameters:
+    - X (array-like): Array of emails, where each email is represented as a list of words.
+    - vocabulary (dict or None): A dictionary mapping each known word to its column index. If None, the vocabulary
+      is built from the words in X. Words of X that are not in a given vocabulary are ignored.
+    - binary (bool): If True, a word is counted only once per email (presence), as in get_word_frequency.
+      If False, every occurrence of the word is counted.
+
+    Returns:
+    - tuple: A tuple containing two elements:
+        1. M (scipy.sparse.csr_matrix): A matrix of shape (len(X), len(vocabulary)), where M[i, j] is the number of
+           times (or 1 if binary = True) the word with index j appears in the i-th email.
+        2. vocabulary (dict): The dictionary mapping each word to its column index in M.
+    """
+    # Number of words in each email, used to know which row every word belongs to
+    lengths = np.array([len(email) for email in X], dtype = np.int64)
+    rows = np.repeat(np.arange(len(X)), lengths)
+
+    # Put every word of every email in a single array. An array of Python strings (dtype object) stores one pointer per
+    # word, while a fixed-width string array would use as much memory per word as the longest word (a long URL, for instance)
+    words = np.fromiter(itertools.chain.from_iterable(X), dtype = object, count = int(lengths.sum()))
+
+    # Every distinct word is looked up only once. pd.factorize hashes the words: inverse maps each word in words
+    # to its position in unique_words, sorted in alphabetical order
+    inverse, unique_words = pd.factorize(words, sort = True)
+
+    if vocabulary is None:
+        # The vocabulary ids follow the sorted order of the words
+        vocabulary = {word: index for index, word in enumerate(unique_words.tolist())}
+        cols = inverse.astype(np.int64)
+    else:
+        # Unknown words get the id -1 and are removed
+        unique_ids = np.array([vocabulary.get(word, -1) for word in unique_words.tolist()], dtype = np.int64)
+        cols = unique_ids[inverse]
+        known = cols >= 0
+        rows, cols = rows[known], cols[known]
+
+    # Repeated (row, col) pairs are summed when converting to CSR format
+    M = sparse.csr_matrix((np.ones(len(cols), dtype = np.int64), (rows, cols)), shape = (len(X), len(vocabulary)))
+    if binary:
+        M.data[:] = 1
+    return M, vocabulary
+
+
+# In[ ]:
+
+
+def get_word_frequency_vectorized(X, Y):
+    """
+    Calculate the frequency of each word in a set of emails categorized as spam (1) or not spam (0),
+    using a sparse document-term matrix instead of a Python loop.
+
+    Parameters:
+    - X (numpy.array): Array of emails, where each email is represented as a list of words.
+    - Y (numpy.array): Array of labels corresponding to each email in X. 1 indicates spam, 0 indicates ham.
+
+    Returns:
+    - word_dict (dict): A dictionary where keys are unique words found in the emails, and values
+      are dictionaries containing the frequency of each word for spam (1) and not spam (0) emails.
+      It is the same dictionary returned by get_word_frequency.
+    """
+    Y = np.asarray(Y)
+
+    # Presence matrix: M[i, j] = 1 if the word j is in the i-th email
+    M, vocabulary = build_document_term_matrix(X, binary = True)
+
+    # One column per class, in the order (spam, ham)
+    C = np.column_stack([Y == 1, Y == 0]).astype(M.dtype)
+
+    # counts[j] = (number of spam emails with word j, number of ham emails with word j)
+    counts = M.T @ C
+
+    # Every word count starts at 1 both in spam and ham, as in get_word_frequency
+    word_dict = {word: {"spam": int(spam) + 1, "ham": int(ham) + 1} for word, (spam, ham) in zip(vocabulary.keys(), counts.tolist())}
+
+    return word_dict
+
+
+# Let's check it gives the same result as the function you implemented in Exercise 1:
+
+# In[ ]:
+
+
+test_output = get_word_frequency_vectorized([['like','going','river'], ['love', 'deep', 'river'], ['hate','river']], [1,0,0])
+print(test_output == get_word_frequency([['like','going','river'], ['love', 'deep', 'river'], ['hate','river']], [1,0,0]))
+
+
+# In[ ]:
+
+
+word_frequency_vectorized = get_word_frequency_vectorized(X_train, Y_train)
+print(f"Both dictionaries are equal? Answer: {word_frequency_vectorized == word_frequency}")
+
+
+# ##### __Expected Output__
+# 
+# ```
+# True
+# Both dictionaries are equal? Answer: True
+# ```
+
+# <a name="5.4"></a>
+# ### 5.4 Scoring a whole test set at once
+# 
+# To evaluate the model, you looped over `X_test` calling `log_naive_bayes` for each email, and each of these calls looks up every word of the email in the `word_frequency` dictionary. The same idea from the previous section can be used here.
+# 
+# Note that, for an email with words $\text{word}_1, \ldots, \text{word}_n$:
+# 
+# $$\log \left(P(\text{class}) \cdot P(\text{email} \mid \text{class}) \right) = \log \left(P(\text{class}) \right) + \sum_{j \in \text{vocabulary}} M_{j} \cdot \log \left(P(\text{word}_j \mid \text{class}) \right)$$
+# 
+# where $M_j$ is the number of times the word $j$ appears in the email. So, if the values $\log \left(P(\text{word}_j \mid \text{class}) \right)$ are computed **once** and stored in a vector $w_{\text{class}}$ with one entry per word of the vocabulary, the log-likelihoods of **every** email are given by the product $M w_{\text{class}}$, where $M$ is now the document-term matrix of the test set counting every occurrence of a word. Words that are not in the vocabulary are ignored, just like in `log_prob_email_given_class`.
+# 
+# The function below computes these vectors, one per class, and stores them in a dictionary, called here a **compiled model**.
+
+# In[ ]:
+
+
+def update_log_probabilities(model):
+    """
+    Computes the log probabilities of a compiled model from its word and class counts, updating the model in place.
+
+    Parameters:
+    - model (dict): A compiled model with the keys 'word_counts' and 'class_counts'.
+    """
+    word_counts = model['word_counts']
+    class_counts = model['class_counts']
+
+    # A class without emails (possible before the first call to partial_fit) has no probabilities yet. Its log prior is
+    # -inf, so it is never predicted, and its log probabilities are left at 0
+    has_emails = class_counts > 0
+    log_class_counts = np.log(np.where(has_emails, class_counts, 1))
+
+    # log(P(word | class)) = log(amount of times the word appears with the class / amount of emails in the class)
+    # Each row is stored contiguously in memory, so the values for one class are read sequentially
+    model['log_prob'] = np.ascontiguousarray(np.log(word_counts) - log_class_counts[:, np.newaxis])
+    model['log_prob'][~has_emails] = 0
+    model['log_prior'] = np.where(has_emails, log_class_counts - np.log(max(class_counts.sum(), 1)), -np.inf)
+
+    # Ids that never appeared in the training emails (possible with a HashedVocabulary) still have all their counts at 1.
+    # They are ignored, just like words that are not in the vocabulary
+    unseen = np.all(word_counts == 1, axis = 0)
+    model['log_prob'][:, unseen] = 0
+
+def compile_naive_bayes(word_frequency, class_frequency):
+    """
+    Compiles the word and class frequency dictionaries into arrays of log probabilities.
+
+    Parameters:
+    - word_frequency (dict): The dictionary containing the words frequency.
+    - class_frequency (dict): The dictionary containing the class frequency.
+
+    Returns:
+    - model (dict): A dictionary with the following keys:
+        - 'classes' (list): The class names, ['spam', 'ham']. Every array below follows this order.
+        - 'vocabulary' (dict): A dictionary mapping each word to its index.
+        - 'word_counts' (numpy.array): An array of shape (2, number of words), where word_counts[k, j] is the
+          amount of times the word j appears with the class k (starting at 1, as in word_frequency).
+        - 'class_counts' (numpy.array): An array with the amount of emails in each class.
+        - 'log_prob' (numpy.array): An array of shape (2, number of words), where log_prob[k, j] = log(P(word j | class k)).
+        - 'log_prior' (numpy.array): An array with log(P(class k)) for each class.
+    """
+    classes = ['spam', 'ham']
+
+    vocabulary = {word: index for index, word in enumerate(word_frequency.keys())}
+
+    word_counts = np.array([[word_frequency[word][cls] for word in vocabulary] for cls in classes], dtype = np.int64).reshape(len(classes), len(vocabulary))
+    class_counts = np.array([class_frequency[cls] for cls in classes], dtype = np.int64)
+
+    model = {'classes': classes, 'vocabulary': vocabulary, 'word_counts': word_counts, 'class_counts': class_counts}
+    update_log_probabilities(model)
+    return model
+
+
+# In[ ]:
+
+
+def log_naive_bayes_batch(X, model, return_likelihood = False):
+    """
+    Naive Bayes classifier for spam detection over a collection of emails, using the log probabilities.
+
+    It gives the same results as calling log_naive_bayes for every email in X (up to rounding errors),
+    but it scores every email at once with a sparse matrix product.
+
+    Parameters:
+    - X (array-like): Array of treated emails, where each email is represented as a list of words.
+    - model (dict): The compiled model returned by compile_naive_bayes.
+    - return_likelihood (bool): If true, it returns the log_likelihood of both spam and ham for every email.
+
+    Returns:
+    If return_likelihood = False:
+        - numpy.array: An array with 1 for every email classified as spam and 0 for every email classified as ham.
+    If return_likelihood = True:
+        - numpy.array: An array of shape (len(X), 2), where each row is (log_spam_likelihood, log_ham_likelihood).
+    """
+    # Every occurrence of a word is counted, as in log_prob_email_given_class
+    M, _ = build_document_term_matrix(X, vocabulary = model['vocabulary'], binary = False)
+
+    # One column per class: log(P(class)) + sum of log(P(word | class)) over the words of the email
+    log_likelihood = M @ model['log_prob'].T + model['log_prior']
+
+    if return_likelihood == True:
+        return log_likelihood
+
+    # Column 0 is spam and column 1 is ham
+    return (log_likelihood[:, 0] >= log_likelihood[:, 1]).astype(int)
+
+
+# In[ ]:
+
+
+model = compile_naive_bayes(word_frequency, class_frequency)
+
+Y_pred_log_naive_bayes_batch = log_naive_bayes_batch(X_test, model)
+
+print(f"Both prediction methods match? Answer: {np.array_equal(Y_pred_log_naive_bayes_batch, Y_pred_log_naive_bayes)}")
+
+
+# ##### __Expected Output__
+# 
+# ```
+# Both prediction methods match? Answer: True
+# ```
+
+# <a name="5.5"></a>
+# ### 5.5 Scoring a single email with the compiled model
+# 
+# When emails arrive one at a time, as in an email software, there is no test set to score at once. However, `log_prob_email_given_class` still does a lot of repeated work for every email: for each word, `prob_word_given_class` looks up the word in `word_frequency`, then the class in the inner dictionary, then the class in `class_frequency`, and finally computes a division and a $\log$. These values never change after training!
+# 
+# The compiled model already stores all of them in the `log_prob` array, where the row is the class and the column is the vocabulary id of the word. So scoring an email reduces to:
+# 
+# 1. Translating each word into its vocabulary id (a single dictionary lookup per word).
+# 2. Gathering the values `log_prob[class, ids]` and summing them.
+
+# In[ ]:
+
+
+def get_word_ids(treated_email, vocabulary):
+    """
+    Translates the words of an email into their vocabulary ids.
+
+    Parameters:
+    - treated_email (list): A list of treated words in the email.
+    - vocabulary (dict): A dictionary mapping each word to its index.
+
+    Returns:
+    - numpy.array: An array with the index of every word of the email that is in the vocabulary.
+    """
+    ids = [vocabulary.get(word, -1) for word in treated_email]
+    ids = np.array(ids, dtype = np.int64)
+    # Words that are not in the vocabulary are ignored
+    return ids[ids >= 0]
+
+
+# In[ ]:
+
+
+def log_prob_email_given_class_compiled(treated_email, cls, model):
+    """
+    Calculate the log probability of an email being of a certain class (e.g., spam or ham) using the compiled model.
+
+    Parameters:
+    - treated_email (list): A list of treated words in the email.
+    - cls (str): The class label ('spam' or 'ham')
+    - model (dict): The compiled model returned by compile_naive_bayes.
+
+    Returns:
+    - float: The log probability of the given email belonging to the specified class.
+    """
+    ids = get_word_ids(treated_email, model['vocabulary'])
+    k = model['classes'].index(cls)
+    return model['log_prob'][k, ids].sum()
+
+
+# In[ ]:
+
+
+def log_naive_bayes_compiled(treated_email, model, return_likelihood = False):
+    """
+    Naive Bayes classifier for spam detection, comparing the log probabilities stored in the compiled model.
+
+    It gives the same results as log_naive_bayes (up to rounding errors).
+
+    Parameters:
+    - treated_email (list): A preprocessed representation of the input email.
+    - model (dict): The compiled model returned by compile_naive_bayes.
+    - return_likelihood (bool): If true, it returns the log_likelihood of both spam and ham.
+
+    Returns:
+    If return_likelihood = False:
+        - int: 1 if the email is classified as spam, 0 if classified as ham.
+    If return_likelihood = True:
+        - tuple: A tuple with the format (log_spam_likelihood, log_ham_likelihood)
+    """
+    # The word ids are computed only once and used for both classes
+    ids = get_word_ids(treated_email, model['vocabulary'])
+
+    # Gather log(P(word | class)) for every word of the email and sum them, for both classes at once
+    log_likelihood = model['log_prob'][:, ids].sum(axis = 1) + model['log_prior']
+
+    log_spam_likelihood, log_ham_likelihood = log_likelihood[model['classes'].index('spam')], log_likelihood[model['classes'].index('ham')]
+
+    if return_likelihood == True:
+        return (log_spam_likelihood, log_ham_likelihood)
+
+    if log_spam_likelihood >= log_ham_likelihood:
+        return 1
+    else:
+        return 0
+
+
+# In[ ]:
+
+
+log_spam_likelihood, log_ham_likelihood = log_naive_bayes_compiled(treated_email, model, return_likelihood = True)
+print(f"log_spam_likelihood: {log_spam_likelihood}\nlog_ham_likelihood: {log_ham_likelihood}")
+print(f"Compiled log Naive bayes model classifies it as: {log_naive_bayes_compiled(treated_email, model)}")
+
+
+# The values match the ones you computed with `log_naive_bayes` in Section 5.1, up to the last decimal places.
+
+# <a name="5.6"></a>
+# ### 5.6 Preprocessing large mailboxes in parallel
+# 
+# Once training and scoring are vectorized, most of the time is spent in `preprocess_text`. It tokenizes every email one after the other, on a single CPU core, and it needs the whole dataset in memory, both before and after the preprocessing. This is not a problem for the $5728$ emails in this dataset, but a real mailbox may have tens of gigabytes.
+# 
+# The function `preprocess_text_stream` below solves both problems:
+# 
+# - It accepts any **iterator** of raw emails (for instance, a generator reading the messages of a mailbox file one by one) and splits it into chunks of `chunk_size` emails.
+# - The chunks are tokenized in parallel by a pool of processes, one per CPU core, with [`ProcessPoolExecutor`](https://docs.python.org/3/library/concurrent.futures.html#processpoolexecutor).
+# - Only a few chunks are sent to the pool at a time (`max_pending`), so the memory used is bounded no matter how large the input is.
+# - The results are **yielded** in the same order as the input, one email at a time.
+# 
+# If a vocabulary is given, each email is returned directly as an array of vocabulary ids (see Section 5.5), which is much smaller than an array of strings. The vocabulary is sent only once to each process, when it starts.
+# 
+# **Note**: The worker processes run the functions `preprocess_chunk` and `init_preprocess_worker` defined in this notebook. This only works when the processes are created with the `fork` [start method](https://docs.python.org/3/library/multiprocessing.html#contexts-and-start-methods), which copies the notebook process, so `preprocess_text_stream` asks for it explicitly (since Python 3.14 it is no longer the default on Linux). `fork` is not available on Windows: there, the two functions must be defined in a `.py` file and imported.
+
+# In[ ]:
+
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Vocabulary used by each worker process, set once by init_preprocess_worker
+worker_vocabulary = None
+
+def init_preprocess_worker(vocabulary):
+    """
+    Stores the vocabulary in the worker process, so it is not sent again with every chunk.
+
+    Parameters:
+    - vocabulary (dict or None): A dictionary mapping each word to its index.
+    """
+    global worker_vocabulary
+    worker_vocabulary = vocabulary
+
+def preprocess_chunk(chunk):
+    """
+    Preprocesses a chunk of raw emails, removing stopwords and punctuation.
+
+    Parameters:
+    - chunk (list): A list of raw emails (str).
+
+    Returns:
+    - list: A list with one numpy array per email. If the worker has a vocabulary, the arrays contain the vocabulary ids
+      of the words, otherwise they contain the words themselves.
+    """
+    X_preprocessed = []
+    for email in chunk:
+        words = [word for word in (token.lower() for token in word_tokenize(email)) if word not in STOP_WORDS]
+        if worker_vocabulary is None:
+            X_preprocessed.append(np.array(words, dtype = object))
+        else:
+            X_preprocessed.append(get_word_ids(words, worker_vocabulary))
+    return X_preprocessed
+
+
+# In[ ]:
+
+
+def preprocess_text_stream(emails, vocabulary = None, chunk_size = 1000, max_workers = None, max_pending = None):
+    """
+    Preprocesses a stream of emails in parallel, removing stopwords and punctuation.
+
+    Parameters:
+    - emails (iterable): An iterable of raw emails (str). It is read lazily, chunk by chunk.
+    - vocabulary (dict or None): A dictionary mapping each word to its index. If given, each email is returned as an array
+      with the ids of its words in the vocabulary. Words that are not in the vocabulary are ignored.
+    - chunk_size (int): The number of emails sent to a worker process at a time.
+    - max_workers (int or None): The number of worker processes. If None, one per CPU core.
+    - max_pending (int or None): The maximum number of chunks being processed at the same time. If None, twice the number
+      of workers. The memory used is proportional to max_pending * chunk_size.
+
+    Yields:
+    - numpy.array: The preprocessed emails, one at a time, in the same order as the input.
+
+    Note:
+    - The worker processes are created with the 'fork' start method, so they can run the functions defined in this notebook.
+      Where 'fork' is not available (Windows), preprocess_chunk and init_preprocess_worker must be imported from a module.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    if max_pending is None:
+        max_pending = 2 * max_workers
+
+    emails = iter(emails)
+    # Splits the stream into lists of chunk_size emails. The last one may be smaller.
+    chunks = iter(lambda: list(itertools.islice(emails, chunk_size)), [])
+
+    # Functions defined in a notebook can't be pickled by reference, so the workers must be forked from this process
+    mp_context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+
+    with ProcessPoolExecutor(max_workers = max_workers, mp_context = mp_context,
+                             initializer = init_preprocess_worker, initargs = (vocabulary,)) as executor:
+        # The chunks being processed, in the input order
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(preprocess_chunk, chunk))
+            # Wait for the oldest chunk before reading more emails
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+# In[ ]:
+
+
+X_treated_stream = list(preprocess_text_stream(X))
+
+print(f"Both preprocessing methods match? Answer: {all(np.array_equal(a, b) for a, b in zip(X_treated_stream, X_treated))}")
+
+
+# ##### __Expected Output__
+# 
+# ```
+# Both preprocessing methods match? Answer: True
+# ```
+# 
+# With the vocabulary of the compiled model, the test set can go straight from raw text to the vocabulary ids used to score it:
+
+# In[ ]:
+
+
+X_test_ids = list(preprocess_text_stream(X[TRAIN_SIZE:], vocabulary = model['vocabulary']))
+
+print(f"The first test email has {len(X_test_ids[0])} words in the vocabulary: {X_test_ids[0][:10]} ...")
+
+
+# <a name="5.7"></a>
+# ### 5.7 Updating the model with new emails
+# 
+# In a real email software, users keep marking emails as spam (or as not spam). These are new labelled emails, and the model should learn from them. With the functions you have so far, the only way to do it is to call `get_word_frequency` again over the whole training set, plus the new emails.
+# 
+# But look again at how the model is built: every probability comes from **counts**, and counts can simply be added! The compiled model keeps the counts it was built from (`word_counts` and `class_counts`), so the new emails can be counted alone and added to them:
+# 
+# - Words already in the vocabulary keep their ids and their counts are increased.
+# - New words are appended to the end of the vocabulary, with counts starting at 1 both in spam and ham, just like in `get_word_frequency`.
+# - Finally, the log probabilities are updated. Only the words of the new emails have new counts, so only their logarithms are computed again. The new class counts change $\log P(\text{word} \mid \text{class}) = \log(\text{word count}) - \log(\text{class count})$ of every other word by the same amount, a single subtraction per class.
+# 
+# The result is **exactly** the same model you would get by training from scratch with all the emails (only the order of the vocabulary ids may differ).
+
+# In[ ]:
+
+
+def partial_fit(model, X_new, Y_new):
+    """
+    Updates a compiled model with new labelled emails, in place.
+
+    Parameters:
+    - model (dict): The compiled model returned by compile_naive_bayes.
+    - X_new (array-like): Array of new treated emails, where each email is represented as a list of words.
+    - Y_new (array-like): Array of labels corresponding to each email in X_new. 1 indicates spam, 0 indicates ham.
+
+    Returns:
+    - model (dict): The same compiled model, updated with the counts of the new emails.
+
+    Raises:
+    - ValueError: If X_new and Y_new have different lengths or Y_new contains labels other than 0 and 1.
+    """
+    Y_new = np.asarray(Y_new)
+    if len(Y_new) != len(X_new):
+        raise ValueError(f"X_new and Y_new must have the same length, got {len(X_new)} and {len(Y_new)}")
+    if not np.isin(Y_new, (0, 1)).all():
+        raise ValueError("The labels must be 0 or 1")
+    vocabulary = model['vocabulary']
+    num_classes = len(model['classes'])
+
+    # Grow the vocabulary in place: every new word gets the next free id. Each distinct word is checked only once
+    num_words = len(vocabulary)
+    words = np.fromiter(itertools.chain.from_iterable(X_new), dtype = object)
+    for word in sorted(pd.unique(words).tolist()):
+        if word not in vocabulary:
+            vocabulary[word] = len(vocabulary)
+
+    # The arrays only grow if there are new words. Their counts start at 1 both in spam and ham, and their log
+    # probabilities are computed below, since they appear in the new emails
+    num_new_words = len(vocabulary) - num_words
+    if num_new_words > 0:
+        model['word_counts'] = np.hstack([model['word_counts'], np.ones((num_classes, num_new_words), dtype = model['word_counts'].dtype)])
+        model['log_prob'] = np.hstack([model['log_prob'], np.zeros((num_classes, num_new_words))])
+
+    # Presence of the words in the new emails, as (email, word id) pairs
+    M, _ = build_document_term_matrix(X_new, vocabulary = vocabulary, binary = True)
+    M = M.tocoo()
+
+    # Count the pairs of each class, in the order of model['classes'] (spam, ham), for the words of the new emails only
+    columns, pair_columns = np.unique(M.col, return_inverse = True)
+    pair_classes = np.where(Y_new == 1, 0, 1)[M.row]
+    new_counts = np.zeros((num_classes, len(columns)), dtype = model['word_counts'].dtype)
+    np.add.at(new_counts, (pair_classes, pair_columns), 1)
+
+    previous_class_counts = model['class_counts'].copy()
+    model['word_counts'][:, columns] += new_counts
+    model['class_counts'] += np.array([np.sum(Y_new == 1), np.sum(Y_new == 0)])
+
+    if np.any(previous_class_counts == 0):
+        # The first emails of a class: none of its probabilities exist yet, so all of them are computed
+        update_log_probabilities(model)
+        return model
+
+    # More emails in a class decrease log(P(word | class)) by the same amount for every word seen in the training emails
+    # (ids that were never seen keep 0, as in update_log_probabilities)
+    log_class_counts = np.log(model['class_counts'])
+    shift = log_class_counts - np.log(previous_class_counts)
+    changed_classes = np.flatnonzero(shift)
+    if len(changed_classes) > 0:
+        seen = np.any(model['word_counts'] != 1, axis = 0)
+        for k in changed_classes:
+            model['log_prob'][k, seen] -= shift[k]
+
+    # Only the words of the new emails have new counts
+    model['log_prob'][:, columns] = np.log(model['word_counts'][:, columns]) - log_class_counts[:, np.newaxis]
+    model['log_prior'] = log_class_counts - np.log(model['class_counts'].sum())
+    return model
+
+def train_compiled_naive_bayes(X, Y):
+    """
+    Trains a compiled Naive Bayes model, counting the words with get_word_frequency_vectorized.
+
+    Parameters:
+    - X (array-like): Array of treated emails, where each email is represented as a list of words.
+    - Y (array-like): Array of labels corresponding to each email in X. 1 indicates spam, 0 indicates ham.
+
+    Returns:
+    - model (dict): The compiled model returned by compile_naive_bayes.
+    """
+    Y = np.asarray(Y)
+    class_frequency = {'ham': int(np.sum(Y == 0)), 'spam': int(np.sum(Y == 1))}
+    return compile_naive_bayes(get_word_frequency_vectorized(X, Y), class_frequency)
+
+
+# Let's check it. The next cell trains a model with the first half of the training set and then updates it with the second half. The result is compared with the model trained with the whole training set.
+
+# In[ ]:
+
+
+half = len(X_train)//2
+
+# Train with the first half of the training set
+model_updated = train_compiled_naive_bayes(X_train[:half], Y_train[:half])
+
+# Update it with the second half
+model_updated = partial_fit(model_updated, X_train[half:], Y_train[half:])
+
+# The vocabulary ids may be in a different order, so compare the counts word by word
+same_counts = all(np.array_equal(model_updated['word_counts'][:, model_updated['vocabulary'][word]], model['word_counts'][:, index]) for word, index in model['vocabulary'].items())
+
+print(f"Same vocabulary? Answer: {model_updated['vocabulary'].keys() == model['vocabulary'].keys()}")
+print(f"Same counts? Answer: {same_counts and np.array_equal(model_updated['class_counts'], model['class_counts'])}")
+
+
+# ##### __Expected Output__
+# 
+# ```
+# Same vocabulary? Answer: True
+# Same counts? Answer: True
+# ```
+
+# <a name="5.8"></a>
+# ### 5.8 Bounding the memory with feature hashing
+# 
+# The vocabulary keeps every distinct word ever seen, and real emails are full of unique tokens: names, numbers, links, typos... In Python, each entry of `word_frequency` costs a string plus a nested dictionary, that is, hundreds of bytes, and the vocabulary keeps growing as new emails arrive. 
+# 
+# A common trick to bound the memory is called [**feature hashing**](https://en.wikipedia.org/wiki/Feature_hashing) (or the *hashing trick*). Instead of storing the words, a [hash function](https://en.wikipedia.org/wiki/Hash_function) maps every word to one of a fixed number of **buckets**, and the counts are stored per bucket in an `int32` array. The memory used is known in advance: $2$ classes $\times$ `num_buckets` $\times$ $4$ bytes, no matter how many distinct words there are. For example, with $2^{20}$ buckets the counts use $8$ MB.
+# 
+# The price to pay is that different words may fall in the same bucket (a **collision**) and then they share their counts. The more buckets, the fewer collisions.
+# 
+# The hash function used is [CRC32](https://docs.python.org/3/library/zlib.html#zlib.crc32). Python's built-in `hash` can't be used, as it changes every time Python is started.
+# 
+# The class `HashedVocabulary` below works like the vocabulary dictionary of a compiled model, so every function you defined for compiled models, such as `log_naive_bayes_batch` and `partial_fit`, also works with a hashed model. Buckets where no word of the training set falls are ignored when scoring, just like unknown words in the exact model.
+
+# In[ ]:
+
+
+import zlib
+
+class HashedVocabulary:
+    """
+    A vocabulary that maps every word to one of num_buckets ids with a hash function, instead of storing the words.
+    It can be used in place of the vocabulary dictionary of a compiled model.
+    """
+    def __init__(self, num_buckets):
+        self.num_buckets = num_buckets
+
+    def __len__(self):
+        return self.num_buckets
+
+    def __contains__(self, word):
+        # Every word has a bucket
+        return True
+
+    def get(self, word, default = None):
+        return zlib.crc32(word.encode('utf-8')) % self.num_buckets
+
+
+# In[ ]:
+
+
+def train_naive_bayes_hashed(X, Y, num_buckets = 2**20):
+    """
+    Trains a compiled Naive Bayes model where the words are mapped to a fixed number of buckets by a hash function.
+
+    Parameters:
+    - X (numpy.array): Array of emails, where each email is represented as a list of words.
+    - Y (numpy.array): Array of labels corresponding to each email in X. 1 indicates spam, 0 indicates ham.
+    - num_buckets (int): The number of buckets. The counts use 2 * num_buckets * 4 bytes.
+
+    Returns:
+    - model (dict): A compiled model, as the one returned by compile_naive_bayes, with a HashedVocabulary.
+    """
+    classes = ['spam', 'ham']
+    # No emails seen yet: every bucket count starts at 1 both in spam and ham, as in get_word_frequency
+    model = {'classes': classes,
+             'vocabulary': HashedVocabulary(num_buckets),
+             'word_counts': np.ones((len(classes), num_buckets), dtype = np.int32),
+             'class_counts': np.zeros(len(classes), dtype = np.int64)}
+    return partial_fit(model, X, Y)
+
+
+# Let's measure the trade-off between the number of buckets and the accuracy in the test set, compared to the exact model:
+
+# In[ ]:
+
+
+accuracy_exact = np.mean(log_naive_bayes_batch(X_test, model) == Y_test)
+print(f"Exact model: accuracy {accuracy_exact:.4f} with {len(model['vocabulary'])} words")
+
+for num_buckets in [2**8, 2**10, 2**12, 2**14, 2**16, 2**18, 2**20]:
+    model_hashed = train_naive_bayes_hashed(X_train, Y_train, num_buckets = num_buckets)
+    accuracy_hashed = np.mean(log_naive_bayes_batch(X_test, model_hashed) == Y_test)
+    print(f"{num_buckets:>8} buckets: accuracy {accuracy_hashed:.4f}, counts use {model_hashed['word_counts'].nbytes/2**20:.3f} MB")
+
+
+# When you run the cell, look at how the accuracy changes with the number of buckets. With few buckets, many words share their counts, so you can expect a lower accuracy than the exact model. As the number of buckets grows past the size of the vocabulary printed in the first line, collisions become rare, so the accuracy should get close to the one of the exact model. Whatever the accuracy, the memory of the counts depends only on the number of buckets, not on the number of distinct words.
+
+# <a name="5.9"></a>
+# ### 5.9 Choosing the decision threshold
+# 
+# So far, an email is classified as spam whenever $\log \left(P(\text{spam}) \cdot P(\text{email} \mid \text{spam}) \right) \geq \log \left(P(\text{ham}) \cdot P(\text{email} \mid \text{ham}) \right)$. This is the same as saying that the **log-odds** of the email,
+# 
+# $$\text{score} = \log \left(P(\text{spam}) \cdot P(\text{email} \mid \text{spam}) \right) - \log \left(P(\text{ham}) \cdot P(\text{email} \mid \text{ham}) \right),$$
+# 
+# is greater than or equal to $0$. But $0$ is not the only possible choice! In Section 5.2 you saw that sending a ham email to the spam folder is much worse than letting a spam email pass, so you may want to classify an email as spam only if its score is greater than or equal to some larger **threshold**. A larger threshold gives fewer false positives (better precision), but also fewer true positives (worse recall).
+# 
+# To pick the threshold, you need the precision and the recall for **every** possible threshold. Running the classifier again for each of them would be very slow. Instead, note that if the emails are sorted by decreasing score, then choosing a threshold equal to the score of the $i$-th email classifies exactly the first $i$ emails as spam. So the number of true positives and false positives for every threshold is given by the **cumulative sums** of the true labels in this order. One sort and two cumulative sums give everything!
+# 
+# With these counts you can draw two curves:
+# 
+# - The [ROC curve](https://en.wikipedia.org/wiki/Receiver_operating_characteristic), with the recall (also called true positive rate) against the **false positive rate** (the proportion of ham emails classified as spam).
+# - The [precision-recall curve](https://en.wikipedia.org/wiki/Precision_and_recall), with the precision against the recall.
+# 
+# The area under the ROC curve (AUC) summarizes the model in a single number: it is the probability that a random spam email has a higher score than a random ham email. A perfect model has AUC $= 1$ and random guessing has AUC $= 0.5$.
+
+# In[ ]:
+
+
+def area_under_curve(x, y):
+    """
+    Calculate the area under a curve with the trapezoidal rule.
+
+    Parameters:
+    - x (numpy.array): The x coordinates of the points of the curve, in increasing order.
+    - y (numpy.array): The y coordinates of the points of the curve.
+
+    Returns:
+    - float: The area under the curve.
+    """
+    return float(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2))
+
+def threshold_sweep(Y_true, scores):
+    """
+    Calculate the precision, recall and false positive rate for every distinct threshold on the scores,
+    where an email is classified as spam (1) if its score is greater than or equal to the threshold.
+
+    Parameters:
+    - Y_true (array-like): True labels (0 or 1) for each instance.
+    - scores (array-like): The score (for instance, the log-odds) of each instance. Higher scores mean more likely to be spam.
+
+    Returns:
+    - dict: A dictionary with the following keys:
+        - 'thresholds' (numpy.array): The distinct scores, in decreasing order, starting with infinity (nothing is spam).
+        - 'true_positives', 'false_positives' (numpy.array): The counts for each threshold.
+        - 'precision', 'recall', 'fpr' (numpy.array): The precision, the recall and the false positive rate for each threshold.
+        - 'roc_auc' (float): The area under the ROC curve.
+        - 'pr_auc' (float): The area under the precision-recall curve (average precision).
+      The recall and the precision-recall area are nan if there are no spam emails, and the false positive rate and the
+      ROC area are nan if there are no ham emails, since they are not defined.
+    """
+    Y_true = np.asarray(Y_true)
+    scores = np.asarray(scores, dtype = np.float64)
+
+    # Sort the emails by decreasing score
+    order = np.argsort(-scores, kind = 'stable')
+    scores = scores[order]
+    Y_true = Y_true[order]
+
+    # Only the last email of each group of equal scores gives a threshold
+    last = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+
+    # true_positives[i] = number of spam emails among the first i + 1 emails
+    true_positives = np.cumsum(Y_true == 1)[last]
+    false_positives = np.cumsum(Y_true == 0)[last]
+
+    # The first threshold, infinity, classifies every email as ham
+    thresholds = np.r_[np.inf, scores[last]]
+    true_positives = np.r_[0, true_positives]
+    false_positives = np.r_[0, false_positives]
+
+    # With a single class, the recall or the false positive rate would divide by zero
+    num_spam, num_ham = true_positives[-1], false_positives[-1]
+    recall = true_positives/num_spam if num_spam > 0 else np.full(len(thresholds), np.nan)
+    fpr = false_positives/num_ham if num_ham > 0 else np.full(len(thresholds), np.nan)
+    # With no email classified as spam the precision is undefined. By convention it is 1
+    precision = np.ones(len(thresholds))
+    precision[1:] = true_positives[1:]/(true_positives[1:] + false_positives[1:])
+
+    return {'thresholds': thresholds,
+            'true_positives': true_positives,
+            'false_positives': false_positives,
+            'precision': precision,
+            'recall': recall,
+            'fpr': fpr,
+            'roc_auc': area_under_curve(fpr, recall) if num_spam > 0 and num_ham > 0 else np.nan,
+            'pr_auc': float(np.sum(np.diff(recall) * precision[1:])) if num_spam > 0 else np.nan}
+
+
+# Let's compute the curves for the test set, using the log-odds given by `log_naive_bayes_batch`:
+
+# In[ ]:
+
+
+log_likelihood = log_naive_bayes_batch(X_test, model, return_likelihood = True)
+# Column 0 is spam and column 1 is ham
+log_odds = log_likelihood[:, 0] - log_likelihood[:, 1]
+
+sweep = threshold_sweep(Y_test, log_odds)
+
+print(f"Number of distinct thresholds: {len(sweep['thresholds'])}")
+print(f"ROC AUC: {sweep['roc_auc']:.4f}")
+print(f"Precision-recall AUC: {sweep['pr_auc']:.4f}")
+
+
+# Now choosing the threshold is just a matter of looking at the arrays. For instance, the threshold with the highest recall that does not send any ham email of the test set to the spam folder is:
+
+# In[ ]:
+
+
+# The recall increases with the index, so take the last index with no false positives
+index = np.flatnonzero(sweep['false_positives'] == 0)[-1]
+
+print(f"Threshold: {sweep['thresholds'][index]:.4f}")
+print(f"Precision: {sweep['precision'][index]:.4f}\nRecall: {sweep['recall'][index]:.4f}\nFalse positive rate: {sweep['fpr'][index]:.4f}")
+
+
+# <a name="5.10"></a>
+# ### 5.10 Saving the model to disk
+# 
+# Every time this notebook runs, it loads the CSV file, preprocesses every email and trains the model again. An email software can't do this every time it starts! The model must be saved once and loaded when needed.
+# 
+# The compiled model is saved in a folder with four files:
+# 
+# - `vocabulary.bin`: every word of the vocabulary, **sorted**, encoded in UTF-8 and written one after the other.
+# - `offsets.npy`: where each word starts and ends in `vocabulary.bin`. The word with id $j$ is the slice `offsets[j]:offsets[j + 1]`.
+# - `log_prob.npy`: the `log_prob` array, with the columns in the same order as the sorted words, in `float32` to use half the space.
+# - `meta.json`: the class names and their log prior probabilities.
+# 
+# Each file is first written with a temporary name in the same folder and then renamed with `os.replace`, which is **atomic**: a program loading the model at the same time sees either the old file or the new one, never a half-written one. `meta.json` is renamed last, so the new files are all in place when it is.
+# 
+# These files are not read into memory when the model is loaded. Instead, they are [memory-mapped](https://numpy.org/doc/stable/reference/generated/numpy.memmap.html): the operating system reads the pieces of the files only when they are used, and keeps them in its page cache. Loading a model takes only milliseconds, and many processes classifying emails at the same time share one copy of the model in memory.
+# 
+# Since the words are sorted, the id of a word is found with a [binary search](https://en.wikipedia.org/wiki/Binary_search_algorithm) directly in `vocabulary.bin`. The class `SortedVocabulary` does this and works like the vocabulary dictionary of a compiled model, so the loaded model can be used with `log_naive_bayes_batch` and `log_naive_bayes_compiled`. As a loaded model has no counts, it can't be updated with `partial_fit`.
+
+# In[ ]:
+
+
+class SortedVocabulary:
+    """
+    A vocabulary stored as sorted UTF-8 words in a single buffer, where the id of each word is its position.
+    It can be used in place of the vocabulary dictionary of a compiled model.
+    """
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def word(self, index):
+        # The encoded word with the given id
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes()
+
+    def get(self, word, default = None):
+        key = word.encode('utf-8')
+        # Binary search for the first word that is not smaller than key
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high)//2
+            if self.word(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self) and self.word(low) == key:
+            return low
+        return default
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+
+# In[ ]:
+
+
+import json
+import tempfile
+
+def save_naive_bayes(model, path):
+    """
+    Saves a compiled model in a folder, in a format that can be memory-mapped by load_naive_bayes.
+
+    Parameters:
+    - model (dict): The compiled model returned by compile_naive_bayes.
+    - path (str): The folder where the model is saved. It is created if it does not exist. Files of a model previously
+      saved in the same folder that this model doesn't use are removed.
+    """
+    os.makedirs(path, exist_ok = True)
+    vocabulary = model['vocabulary']
+
+    # The temporary file of each saved file, in the order they are renamed
+    temporary_paths = {}
+
+    def open_temporary(filename):
+        # Create the temporary file in the same folder, since os.replace can't move a file to another file system
+        fd, temporary_path = tempfile.mkstemp(dir = path, prefix = filename + '.', suffix = '.tmp')
+        temporary_paths[filename] = temporary_path
+        return os.fdopen(fd, 'w' if filename.endswith('.json') else 'wb')
+
+    try:
+        if isinstance(vocabulary, HashedVocabulary):
+            # A hashed vocabulary has no words to save, the columns are already the bucket ids
+            meta_vocabulary = {'num_buckets': vocabulary.num_buckets}
+            columns = slice(None)
+        else:
+            words = list(vocabulary.keys())
+            ids = np.array(list(vocabulary.values()), dtype = np.int64)
+
+            # Sort the words. The sorted order of Python strings is the same as the one of their UTF-8 encoding.
+            # Sorting the positions avoids a fixed-width string array, as large as the longest word times the number of words
+            order = sorted(range(len(words)), key = words.__getitem__)
+            encoded_words = [words[index].encode('utf-8') for index in order]
+
+            offsets = np.zeros(len(encoded_words) + 1, dtype = np.int64)
+            offsets[1:] = np.cumsum([len(encoded_word) for encoded_word in encoded_words])
+            with open_temporary('vocabulary.bin') as f:
+                f.write(b''.join(encoded_words))
+            with open_temporary('offsets.npy') as f:
+                np.save(f, offsets)
+
+            meta_vocabulary = {'num_words': len(encoded_words)}
+            # The column of each word follows the sorted order
+            columns = ids[order]
+
+        with open_temporary('log_prob.npy') as f:
+            np.save(f, np.ascontiguousarray(model['log_prob'][:, columns], dtype = np.float32))
+        # Bernoulli models from train_naive_bayes also need the probabilities of the absent words
+        if 'log_prob_absent' in model:
+            with open_temporary('log_prob_absent.npy') as f:
+                np.save(f, np.ascontiguousarray(model['log_prob_absent'][:, columns], dtype = np.float32))
+
+        meta = {'classes': list(model['classes']), 'log_prior': [float(value) for value in model['log_prior']], 'vocabulary': meta_vocabulary}
+        if 'likelihood' in model:
+            meta['likelihood'] = model['likelihood']
+        with open_temporary('meta.json') as f:
+            json.dump(meta, f)
+
+        # Rename the files, meta.json last
+        for filename, temporary_path in temporary_paths.items():
+            os.replace(temporary_path, os.path.join(path, filename))
+    except BaseException:
+        for temporary_path in temporary_paths.values():
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        raise
+
+    # Remove the files of a model saved before in the same folder that this model doesn't use
+    for filename in ('vocabulary.bin', 'offsets.npy', 'log_prob_absent.npy'):
+        if filename not in temporary_paths and os.path.exists(os.path.join(path, filename)):
+            os.remove(os.path.join(path, filename))
+
+def load_naive_bayes(path):
+    """
+    Loads a compiled model saved by save_naive_bayes, memory-mapping its arrays instead of reading them.
+
+    Parameters:
+    - path (str): The folder where the model was saved.
+
+    Returns:
+    - model (dict): A compiled model with the keys 'classes', 'vocabulary', 'log_prob' and 'log_prior'
+      (and 'likelihood' and 'log_prob_absent' if the saved model had them).
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    if 'num_buckets' in meta['vocabulary']:
+        vocabulary = HashedVocabulary(meta['vocabulary']['num_buckets'])
+    else:
+        offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode = 'r')
+        # An empty file can't be memory-mapped
+        if offsets[-1] > 0:
+            blob = np.memmap(os.path.join(path, 'vocabulary.bin'), dtype = np.uint8, mode = 'r')
+        else:
+            blob = np.zeros(0, dtype = np.uint8)
+        vocabulary = SortedVocabulary(blob, offsets)
+
+    model = {'classes': meta['classes'],
+             'vocabulary': vocabulary,
+             'log_prob': np.load(os.path.join(path, 'log_prob.npy'), mmap_mode = 'r'),
+             'log_prior': np.array(meta['log_prior'])}
+    if 'likelihood' in meta:
+        model['likelihood'] = meta['likelihood']
+    # Only Bernoulli models use the probabilities of the absent words
+    if meta.get('likelihood') == 'bernoulli':
+        model['log_prob_absent'] = np.load(os.path.join(path, 'log_prob_absent.npy'), mmap_mode = 'r')
+    return model
+
+
+# In[ ]:
+
+
+# The folder naive_bayes_model is listed in the .gitignore file of this repository, so it is not committed by mistake
+save_naive_bayes(model, 'naive_bayes_model')
+
+loaded_model = load_naive_bayes('naive_bayes_model')
+
+print(f"Both models predict the same? Answer: {np.array_equal(log_naive_bayes_batch(X_test, loaded_model), log_naive_bayes_batch(X_test, model))}")
+
+
+# ##### __Expected Output__
+# 
+# ```
+# Both models predict the same? Answer: True
+# ```
+# 
+# The log probabilities are saved in `float32`, so the likelihoods are slightly different from the ones of the original model. This only changes the prediction of an email whose spam and ham likelihoods are almost equal.
+
+# <a name="5.11"></a>
+# ### 5.11 More than two classes: a general Naive Bayes engine
+# 
+# Nothing in the Naive Bayes algorithm is specific to spam detection: it works with any number of classes, for instance to route support tickets to the right team. For each class $k$, you compare $\log \left(P(\text{class}_k) \right) + \log \left( P(\text{email} \mid \text{class}_k) \right)$ and pick the class with the highest value. In this section you will write a general version of the algorithm with two differences:
+# 
+# **1. Any number of classes.** The classes are the distinct values of `Y`. With the compiled model, the log probabilities of all the classes are the rows of a single array of shape $(K, \text{number of words})$, so the likelihoods for the $K$ classes are computed at once, with the same sparse product of Section 5.4, instead of calling `prob_email_given_class` once per class.
+# 
+# **2. Two ways to model $P(\text{email} \mid \text{class})$.**
+# 
+# - **Bernoulli**: as in `get_word_frequency`, what matters is whether a word **is present** in the email or not. $P(\text{word} \mid \text{class})$ is the proportion of emails of the class that contain the word. Unlike the functions in this notebook, which ignore the words that are not in the email, the full Bernoulli model also takes into account the probability of each **absent** word, $1 - P(\text{word} \mid \text{class})$:
+# 
+# $$\log \left(P(\text{email} \mid \text{class}) \right) = \sum_{\text{word in email}} \log \left(P(\text{word} \mid \text{class}) \right) + \sum_{\text{word not in email}} \log \left(1 - P(\text{word} \mid \text{class}) \right)$$
+# 
+# - **Multinomial**: what matters is **how many times** each word appears. $P(\text{word} \mid \text{class})$ is the proportion of the words of the class that are equal to this word, and each occurrence of a word in the email adds its $\log$ probability.
+# 
+# In both cases the counts are smoothed by adding `alpha` (usually $1$, as you did when starting every count at $1$), so no probability is $0$.
+# 
+# The sum over the absent words can be computed without looking at them, since it is equal to the sum over **every** word minus the sum over the present words:
+# 
+# $$\sum_{\text{word not in email}} \log \left(1 - P \right) = \sum_{\text{every word}} \log \left(1 - P \right) - \sum_{\text{word in email}} \log \left(1 - P \right)$$
+
+# In[ ]:
+
+
+def train_naive_bayes(X, Y, likelihood = 'multinomial', alpha = 1):
+    """
+    Trains a Naive Bayes model with any number of classes.
+
+    Parameters:
+    - X (array-like): Array of treated emails, where each email is represented as a list of words.
+    - Y (array-like): Array of labels corresponding to each email in X. Every distinct label is a class.
+    - likelihood (str): 'bernoulli' to use the presence of the words or 'multinomial' to use the number of occurrences.
+    - alpha (float): The value added to every count to smooth the probabilities.
+
+    Returns:
+    - model (dict): A compiled model with the following keys:
+        - 'classes' (list): The class labels, sorted. Every array below follows this order.
+        - 'vocabulary' (dict): A dictionary mapping each word to its index.
+        - 'likelihood' (str): 'bernoulli' or 'multinomial'.
+        - 'log_prob' (numpy.array): An array of shape (number of classes, number of words), where log_prob[k, j] = log(P(word j | class k)).
+        - 'log_prob_absent' (numpy.array): Only for 'bernoulli'. The values log(1 - P(word j | class k)).
+        - 'log_prior' (numpy.array): An array with log(P(class k)) for each class.
+    """
+    if likelihood not in ('bernoulli', 'multinomial'):
+        raise ValueError(f"likelihood must be 'bernoulli' or 'multinomial', got {likelihood!r}")
+
+    # class_ids[i] is the index of the class of the i-th email
+    classes, class_ids = np.unique(np.asarray(Y), return_inverse = True)
+    num_classes = len(classes)
+
+    M, vocabulary = build_document_term_matrix(X, binary = (likelihood == 'bernoulli'))
+
+    # One column per class, with 1 in the column of the class of each email
+    C = sparse.csr_matrix((np.ones(len(class_ids), dtype = M.dtype), (np.arange(len(class_ids)), class_ids)), shape = (len(class_ids), num_classes))
+
+    # word_counts[k, j] is the number of emails (bernoulli) or occurrences (multinomial) of the word j in the class k
+    word_counts = (C.T @ M).toarray().astype(np.float64)
+    class_counts = np.bincount(class_ids, minlength = num_classes).astype(np.float64)
+
+    model = {'classes': classes.tolist(), 'vocabulary': vocabulary, 'likelihood': likelihood}
+    if likelihood == 'bernoulli':
+        # Proportion of the emails of the class containing the word. Each word is either present or absent, hence 2*alpha
+        prob = (word_counts + alpha)/(class_counts[:, np.newaxis] + 2*alpha)
+        model['log_prob'] = np.ascontiguousarray(np.log(prob))
+        model['log_prob_absent'] = np.ascontiguousarray(np.log1p(-prob))
+    else:
+        # Proportion of the words of the class equal to the word
+        total_words = word_counts.sum(axis = 1, keepdims = True)
+        model['log_prob'] = np.ascontiguousarray(np.log(word_counts + alpha) - np.log(total_words + alpha*len(vocabulary)))
+    model['log_prior'] = np.log(class_counts/class_counts.sum())
+
+    return model
+
+
+# In[ ]:
+
+
+def predict_naive_bayes(X, model, return_likelihood = False):
+    """
+    Classifies a collection of emails with a Naive Bayes model, choosing the class with the highest log likelihood.
+
+    Parameters:
+    - X (array-like): Array of treated emails, where each email is represented as a list of words.
+    - model (dict): A model returned by train_naive_bayes. Models without the 'likelihood' key, such as the ones returned
+      by compile_naive_bayes, are scored as in log_naive_bayes, adding log(P(word | class)) for every word of the email.
+    - return_likelihood (bool): If true, it returns the log likelihood of every class for every email.
+
+    Returns:
+    If return_likelihood = False:
+        - numpy.array: The predicted class label of each email.
+    If return_likelihood = True:
+        - numpy.array: An array of shape (len(X), number of classes), with log(P(class)) + log(P(email | class)).
+    """
+    bernoulli = model.get('likelihood') == 'bernoulli'
+    M, _ = build_document_term_matrix(X, vocabulary = model['vocabulary'], binary = bernoulli)
+
+    if bernoulli:
+        # Present words add log(P) and absent words add log(1 - P). The sum over the absent words is the sum over every
+        # word minus the sum over the present ones
+        log_prob_absent = model['log_prob_absent']
+        log_likelihood = M @ (model['log_prob'] - log_prob_absent).T + log_prob_absent.sum(axis = 1) + model['log_prior']
+    else:
+        log_likelihood = M @ model['log_prob'].T + model['log_prior']
+
+    if return_likelihood == True:
+        return log_likelihood
+
+    # For each email, the class with the highest log likelihood
+    return np.asarray(model['classes'])[np.argmax(log_likelihood, axis = 1)]
+
+
+# Let's train both models in the spam dataset. Here the classes are the labels $0$ (ham) and $1$ (spam), but the same code works with any number of classes.
+
+# In[ ]:
+
+
+for likelihood in ['bernoulli', 'multinomial']:
+    model_general = train_naive_bayes(X_train, Y_train, likelihood = likelihood)
+    Y_pred_general = predict_naive_bayes(X_test, model_general)
+    print(f"{likelihood.capitalize()} Naive Bayes. Classes: {model_general['classes']}. Accuracy: {np.mean(Y_pred_general == Y_test):.4f}. Precision: {get_precision(Y_test, Y_pred_general):.4f}")
+
+
+# <a name="5.12"></a>
+# ### 5.12 Measuring the throughput of the pipeline
+# 
+# You now have several versions of each step of the pipeline. Which one is worth using, and where does the time go? The only reliable way to answer is to **measure**. 
+# 
+# The dataset in this assignment is too small to show the differences, so the function `generate_synthetic_emails` below creates datasets of any size. Real text follows [Zipf's law](https://en.wikipedia.org/wiki/Zipf%27s_law): the $r$-th most common word appears with a frequency proportional to $1/r^s$, with $s$ close to $1$. So a few words are very common and most words are rare, which is what makes the vocabulary grow with the dataset. The synthetic emails follow this law, with a different ranking of the words for spam and ham, so there is something to learn.
+# 
+# The function `benchmark_pipeline` runs each step for datasets of increasing size and measures:
+# 
+# - The time, and the **throughput** in emails per second.
+# - If `trace_memory = True`, the **peak memory** allocated by the step alone, measured with the [`tracemalloc`](https://docs.python.org/3/library/tracemalloc.html) module. Each step still runs only once, but tracing every allocation makes the code slower, so the times measured with `trace_memory = True` are only useful to compare steps with each other. Measure the time and the memory in two separate calls if you need both.
+# 
+# The results are saved in a JSON file, so the results of two versions of the code can be compared. The default file `benchmark_naive_bayes.json` is listed in the `.gitignore` file of this repository, so it is not committed by mistake. The steps that loop over every email in Python, including `preprocess_text`, are skipped for datasets larger than `max_loop_emails`, as they would take hours. The rest of the pipeline uses the emails preprocessed by `preprocess_text_stream`.
+# 
+# **Note**: `tracemalloc` only sees the memory of this process, so the memory used by the worker processes of `preprocess_text_stream` is not included, only the preprocessed emails they send back.
+
+# In[ ]:
+
+
+def generate_synthetic_emails(num_emails, vocabulary_size = 50000, zipf_exponent = 1.1, mean_length = 100, spam_proportion = 0.24, seed = 42, chunk_size = 10**5):
+    """
+    Generates a DataFrame of synthetic emails whose words follow Zipf's law.
+
+    Parameters:
+    - num_emails (int): The number of emails.
+    - vocabulary_size (int): The number of distinct words that can appear.
+    - zipf_exponent (float): The exponent s, where the r-th most common word has frequency proportional to 1/r^s.
+    - mean_length (int): The average number of words in an email.
+    - spam_proportion (float): The proportion of spam emails.
+    - seed (int): The seed of the random number generator.
+    - chunk_size (int): The number of emails whose words are drawn at once. It bounds the memory used by the intermediate arrays.
+
+    Returns:
+    - pandas.DataFrame: A DataFrame with the columns 'text' and 'spam', in the same format as emails.csv.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Probability of the word with rank r
+    word_prob = 1/np.arange(1, vocabulary_size + 1)**zipf_exponent
+    word_prob = word_prob/word_prob.sum()
+    words = np.array([f"word{index}" for index in range(vocabulary_size)])
+    # Spam emails rank the words in a different order
+    spam_ranking = rng.permutation(vocabulary_size)
+
+    spam = (rng.random(num_emails) < spam_proportion).astype(int)
+    lengths = rng.poisson(mean_length, size = num_emails)
+
+    texts = []
+    for start in range(0, num_emails, chunk_size):
+        chunk_spam = spam[start:start + chunk_size]
+        chunk_lengths = lengths[start:start + chunk_size]
+        # Draw the words of all the emails in the chunk in a single call
+        ranks = rng.choice(vocabulary_size, size = chunk_lengths.sum(), p = word_prob)
+        is_spam_word = np.repeat(chunk_spam, chunk_lengths) == 1
+        ranks[is_spam_word] = spam_ranking[ranks[is_spam_word]]
+        tokens = words[ranks].tolist()
+        # Split the words by email, using the cumulative lengths
+        offsets = np.concatenate(([0], np.cumsum(chunk_lengths))).tolist()
+        texts.extend("Subject: " + " ".join(tokens[begin:end]) for begin, end in zip(offsets[:-1], offsets[1:]))
+
+    return pd.DataFrame({'text': texts, 'spam': spam})
+
+
+# In[ ]:
+
+
+import platform
+import time
+import tracemalloc
+
+def benchmark_pipeline(sizes = (10**3, 10**4, 10**5, 10**6, 10**7), output_path = 'benchmark_naive_bayes.json', max_loop_emails = 10**5, trace_memory = False, **corpus_parameters):
+    """
+    Measures the time and the peak memory of each step of the Naive Bayes pipeline on synthetic datasets.
+
+    Parameters:
+    - sizes (iterable): The number of emails of each synthetic dataset.
+    - output_path (str): The JSON file where the results are saved.
+    - max_loop_emails (int): The steps that loop over the emails in Python are skipped for larger datasets.
+    - trace_memory (bool): If True, the peak memory of each step is measured with tracemalloc, which makes the steps slower.
+    - corpus_parameters: Extra parameters passed to generate_synthetic_emails.
+
+    Returns:
+    - list: A list with one dictionary per (size, step), with the keys 'num_emails', 'stage', 'seconds',
+      'emails_per_second' and 'peak_memory_mb' (None if the memory is not traced).
+    """
+    results = []
+
+    def run(stage, num_emails, function, *args):
+        # Run the step once, counting only the memory allocated while it runs
+        peak_memory_mb = None
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            output = function(*args)
+            seconds = time.perf_counter() - start
+            if trace_memory:
+                peak_memory_mb = tracemalloc.get_traced_memory()[1]/2**20
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+
+        results.append({'num_emails': num_emails,
+                        'stage': stage,
+                        'seconds': seconds,
+                        'emails_per_second': num_emails/seconds if seconds > 0 else float('inf'),
+                        'peak_memory_mb': peak_memory_mb})
+        memory = f"{peak_memory_mb:8.1f} MB" if trace_memory else "       - MB"
+        print(f"{num_emails:>10} emails | {stage:<30} | {seconds:10.3f} s | {results[-1]['emails_per_second']:12.0f} emails/s | {memory}")
+        return output
+
+    for num_emails in sizes:
+        dataframe = generate_synthetic_emails(num_emails, **corpus_parameters)
+
+        X_bench, Y_bench = run('preprocess_emails', num_emails, preprocess_emails, dataframe)
+        X_bench_treated = run('preprocess_text_stream', num_emails, lambda X: list(preprocess_text_stream(X)), X_bench)
+        class_frequency_bench = {'ham': int(np.sum(Y_bench == 0)), 'spam': int(np.sum(Y_bench == 1))}
+
+        word_frequency_bench = run('get_word_frequency_vectorized', num_emails, get_word_frequency_vectorized, X_bench_treated, Y_bench)
+        model_bench = run('compile_naive_bayes', num_emails, compile_naive_bayes, word_frequency_bench, class_frequency_bench)
+        run('log_naive_bayes_batch', num_emails, log_naive_bayes_batch, X_bench_treated, model_bench)
+
+        if num_emails <= max_loop_emails:
+            run('preprocess_text', num_emails, preprocess_text, X_bench)
+            run('get_word_frequency', num_emails, get_word_frequency, X_bench_treated, Y_bench)
+            run('naive_bayes', num_emails, lambda X: [naive_bayes(email, word_frequency_bench, class_frequency_bench) for email in X], X_bench_treated)
+            run('log_naive_bayes', num_emails, lambda X: [log_naive_bayes(email, word_frequency_bench, class_frequency_bench) for email in X], X_bench_treated)
+
+        # Free the memory before the next size
+        del dataframe, X_bench, Y_bench, X_bench_treated, word_frequency_bench, model_bench
+
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(), 'results': results}
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent = 1)
+
+    return results
+
+
+# The next cell runs the benchmark for small datasets only, which takes less than a minute. Add larger sizes to the list, up to $10^7$ emails, to measure how each step scales. Keep in mind that the largest sizes need a lot of memory just to hold the synthetic emails.
+
+# In[ ]:
+
+
+benchmark_results = benchmark_pipeline(sizes = [10**3, 10**4])
+
+
+# <a name="5.13"></a>
+# ### 5.13 Testing the functions of the appendix
+# 
+# The graded functions are tested by `w1_unittest`. The cell below tests the functions of this appendix in the same way, on small examples whose results are known: for instance, training a model in three parts with `partial_fit` must give the same model as training it with all the emails at once. Run it after changing any of these functions.
+
+# In[ ]:
+
+
+import tempfile
+
+def test_confusion_counts():
+    assert confusion_counts([0, 0, 1, 1, 1], [0, 1, 0, 1, 1]) == (1, 1, 1, 2)
+    assert confusion_counts(np.array([True, False]), np.array([True, True])) == (0, 1, 0, 1)
+    # Different lengths, labels other than 0 and 1, and probabilities instead of labels are rejected
+    for Y_true, Y_pred in [([0, 1, 1], [1]), ([0, 1, 2], [0, 1, 1]), ([0, 1], [0.5, 1])]:
+        try:
+            confusion_counts(Y_true, Y_pred)
+        except ValueError:
+            continue
+        raise AssertionError(f"confusion_counts accepted {Y_true} and {Y_pred}")
+
+def test_precision_recall():
+    assert np.isclose(get_precision([0, 1, 1, 0], [1, 1, 0, 0]), 0.5) and np.isclose(get_recall([0, 1, 1, 0], [1, 1, 0, 0]), 0.5)
+    # Undefined when nothing is predicted as spam, or when there is no spam
+    assert np.isnan(get_precision([0, 1], [0, 0])) and np.isnan(get_recall([0, 0], [1, 0]))
+
+def test_build_document_term_matrix():
+    # An empty email, a very long word and words that are not in the vocabulary
+    X = [['river', 'like', 'river'], [], ['http://' + 'a' * 1000], ['love', 'river']]
+    M, vocabulary = build_document_term_matrix(X, binary = False)
+    assert list(vocabulary) == sorted(vocabulary)
+    assert M.shape == (4, 4) and M[0, vocabulary['river']] == 2 and M[1].nnz == 0
+    assert (build_document_term_matrix(X)[0].toarray() == (M.toarray() > 0)).all()
+    M_known, _ = build_document_term_matrix(X, vocabulary = {'river': 0, 'love': 1})
+    assert (M_known.toarray() == [[1, 0], [0, 0], [0, 0], [1, 1]]).all()
+
+def test_preprocess_text_stream():
+    # Small chunks, so several workers are used
+    emails = np.array(["Subject: the meeting, is at 10!", "Win a FREE prize now", "", "and to the of", "Call me."] * 3)
+    stream = list(preprocess_text_stream(iter(emails), chunk_size = 2, max_workers = 2, max_pending = 2))
+    assert len(stream) == len(emails)
+    assert all(np.array_equal(a, b) for a, b in zip(stream, preprocess_text(emails)))
+    ids = list(preprocess_text_stream(emails, vocabulary = {'win': 0, 'prize': 1}, chunk_size = 2, max_workers = 2))
+    assert list(ids[1]) == [0, 1] and len(ids[0]) == 0
+
+def test_partial_fit():
+    # Training in three parts gives the same model as training with all the emails
+    rng = np.random.default_rng(0)
+    X = [list(rng.choice(['w0', 'w1', 'w2', 'w3', 'w4', 'w5', 'w6', 'w7'], size = rng.integers(0, 6))) for _ in range(60)]
+    Y = rng.integers(0, 2, size = 60)
+
+    model_full = train_compiled_naive_bayes(X, Y)
+    model_parts = train_compiled_naive_bayes(X[:10], Y[:10])
+    model_parts = partial_fit(model_parts, X[10:35], Y[10:35])
+    # A batch without new words and a batch with a single class
+    model_parts = partial_fit(model_parts, [['w0', 'w1']], [1])
+    model_parts = partial_fit(model_parts, X[35:], Y[35:])
+    model_full = partial_fit(model_full, [['w0', 'w1']], [1])
+
+    assert model_parts['vocabulary'].keys() == model_full['vocabulary'].keys()
+    assert np.array_equal(model_parts['class_counts'], model_full['class_counts'])
+    assert np.allclose(model_parts['log_prior'], model_full['log_prior'])
+    for word, index in model_full['vocabulary'].items():
+        assert np.array_equal(model_parts['word_counts'][:, model_parts['vocabulary'][word]], model_full['word_counts'][:, index])
+        assert np.allclose(model_parts['log_prob'][:, model_parts['vocabulary'][word]], model_full['log_prob'][:, index])
+
+    # A hashed model starts without emails: no warnings, and a class without emails is never predicted
+    with np.errstate(all = 'raise'):
+        hashed = train_naive_bayes_hashed(X[:5], np.zeros(5, dtype = int), num_buckets = 64)
+        assert hashed['log_prior'][0] == -np.inf and np.all(log_naive_bayes_batch(X, hashed) == 0)
+        hashed = partial_fit(hashed, X[5:], Y[5:])
+    hashed_full = train_naive_bayes_hashed(X, np.concatenate([np.zeros(5, dtype = int), Y[5:]]), num_buckets = 64)
+    assert np.allclose(hashed['log_prob'], hashed_full['log_prob']) and np.allclose(hashed['log_prior'], hashed_full['log_prior'])
+
+    # Invalid labels are rejected
+    for X_new, Y_new in [([['w0'], ['w1']], [1]), ([['w0']], [2])]:
+        try:
+            partial_fit(model_parts, X_new, Y_new)
+        except ValueError:
+            continue
+        raise AssertionError(f"partial_fit accepted {Y_new}")
+
+def test_threshold_sweep():
+    # The ROC area is the probability that a random spam email gets a higher score than a random ham email,
+    # counting ties as 1/2
+    rng = np.random.default_rng(0)
+    Y = rng.integers(0, 2, size = 200)
+    scores = np.round(rng.normal(size = 200) + Y, 1)
+    sweep = threshold_sweep(Y, scores)
+    spam_scores, ham_scores = scores[Y == 1], scores[Y == 0]
+    pairwise = (spam_scores[:, None] > ham_scores[None, :]) + 0.5 * (spam_scores[:, None] == ham_scores[None, :])
+    assert np.isclose(sweep['roc_auc'], pairwise.mean())
+    assert sweep['recall'][-1] == 1 and sweep['fpr'][-1] == 1
+    # The areas are undefined with a single class
+    assert np.isnan(threshold_sweep(np.ones(5), np.arange(5))['roc_auc']) and np.isnan(threshold_sweep(np.zeros(5), np.arange(5))['pr_auc'])
+    assert np.isclose(threshold_sweep([0, 0, 1, 1], [0.1, 0.2, 0.8, 0.9])['pr_auc'], 1)
+
+def test_save_load_naive_bayes():
+    rng = np.random.default_rng(1)
+    X = [list(rng.choice(['w0', 'w1', 'w2', 'wé', 'w4', 'w5'], size = rng.integers(1, 6))) for _ in range(40)]
+    Y = rng.integers(0, 2, size = 40)
+    X_unseen = X + [['never', 'seen']]
+
+    # Every model is saved into the same folder, so the files of the previous one must not be used
+    with tempfile.TemporaryDirectory() as path:
+        model = train_compiled_naive_bayes(X, Y)
+        save_naive_bayes(model, path)
+        assert np.allclose(log_naive_bayes_batch(X_unseen, load_naive_bayes(path), return_likelihood = True),
+                           log_naive_bayes_batch(X_unseen, model, return_likelihood = True), atol = 1e-4)
+
+        hashed = train_naive_bayes_hashed(X, Y, num_buckets = 64)
+        save_naive_bayes(hashed, path)
+        assert not os.path.exists(os.path.join(path, 'vocabulary.bin')) and not os.path.exists(os.path.join(path, 'offsets.npy'))
+        assert np.allclose(log_naive_bayes_batch(X_unseen, load_naive_bayes(path), return_likelihood = True),
+                           log_naive_bayes_batch(X_unseen, hashed, return_likelihood = True), atol = 1e-4)
+
+        bernoulli = train_naive_bayes(X, Y, likelihood = 'bernoulli')
+        save_naive_bayes(bernoulli, path)
+        assert np.array_equal(predict_naive_bayes(X_unseen, load_naive_bayes(path)), predict_naive_bayes(X_unseen, bernoulli))
+
+        multinomial = train_naive_bayes(X, Y, likelihood = 'multinomial')
+        save_naive_bayes(multinomial, path)
+        assert not os.path.exists(os.path.join(path, 'log_prob_absent.npy')) and 'log_prob_absent' not in load_naive_bayes(path)
+        assert np.allclose(predict_naive_bayes(X_unseen, load_naive_bayes(path), return_likelihood = True),
+                           predict_naive_bayes(X_unseen, multinomial, return_likelihood = True), atol = 1e-4)
+        # Only the files of the model are left, no temporary file
+        assert sorted(os.listdir(path)) == ['log_prob.npy', 'meta.json', 'offsets.npy', 'vocabulary.bin']
+
+def test_benchmark_pipeline():
+    emails = generate_synthetic_emails(300, vocabulary_size = 50, mean_length = 8, chunk_size = 64)
+    lengths = emails['text'].str.split().str.len() - 1
+    assert len(emails) == 300 and set(emails['spam']) == {0, 1}
+    assert lengths.min() >= 0 and abs(lengths.mean() - 8) < 1
+    assert emails['text'].str.startswith("Subject:").all()
+    # The chunk size changes how the words are drawn, but not the labels or the lengths of the emails
+    other = generate_synthetic_emails(300, vocabulary_size = 50, mean_length = 8, chunk_size = 300)
+    assert (other['spam'] == emails['spam']).all()
+    assert (other['text'].str.split().str.len() - 1 == lengths).all()
+
+    results = benchmark_pipeline(sizes = [100, 400], output_path = os.devnull, max_loop_emails = 100, trace_memory = True, vocabulary_size = 200, mean_length = 10)
+    stages = [(result['num_emails'], result['stage']) for result in results]
+    assert (100, 'preprocess_text') in stages and (400, 'preprocess_text') not in stages
+    assert (400, 'preprocess_text_stream') in stages
+    # Each step is run once
+    assert len(stages) == len(set(stages))
+    assert all(result['peak_memory_mb'] >= 0 for result in results)
+    assert not tracemalloc.is_tracing()
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, 'benchmark.json')
+        results = benchmark_pipeline(sizes = [100], output_path = output_path, max_loop_emails = 0, vocabulary_size = 200, mean_length = 10)
+        assert all(result['peak_memory_mb'] is None for result in results)
+        with open(output_path) as f:
+            assert json.load(f)['results'] == results
+
+test_confusion_counts()
+test_precision_recall()
+test_build_document_term_matrix()
+test_preprocess_text_stream()
+test_partial_fit()
+test_threshold_sweep()
+test_save_load_naive_bayes()
+test_benchmark_pipeline()
+print("\033[92m All tests passed")
+
+
 # Congratulations! You have completed the entire assignment and the appendix section! 
 
 # In[ ]: